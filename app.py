@@ -1,9 +1,18 @@
-from fastapi import FastAPI
+import json
+
+from fastapi import FastAPI, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastmcp import FastMCP
 
 app = FastAPI()
 
+# CORSMiddleware er ren ASGI og svarer selv på preflight (OPTIONS) før routing –
+# ikke legg til egne OPTIONS-ruter.
+# Ny middleware SKAL skrives som ren ASGI-klasse:
+#     class MyMiddleware:
+#         def __init__(self, app): self.app = app
+#         async def __call__(self, scope, receive, send): ...
+# Ikke BaseHTTPMiddleware – den koster ca. 2x per request.
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -17,13 +26,16 @@ mcp = FastMCP("ida-mcp-gateway")
 def ping() -> str:
     return "pong"
 
+# Root brukes som health-probe: svaret er statisk, så vi serialiserer det én gang.
+_ROOT_BODY = json.dumps({
+    "ok": True,
+    "message": "IDA MCP minimal server",
+    "mcp_sse": "/sse/"
+}).encode("utf-8")
+
 @app.get("/")
-def root():
-    return {
-        "ok": True,
-        "message": "IDA MCP minimal server",
-        "mcp_sse": "/sse/"
-    }
+async def root():
+    return Response(content=_ROOT_BODY, media_type="application/json")
 
 # ⛔️ VIKTIG: path må være ROOT /sse – ikke /mcp, ikke noe annet
 app.mount("/sse", mcp.http_app(path="/sse"))
@@ -21,3 +21,22 @@ RESULTS_DIR = env("RESULTS_DIR", "agent_results")
 OPS_LOG_DIR = env("OPS_LOG_DIR", "ops/logs")
 OPS_NEEDS_DIR = env("OPS_NEEDS_DIR", "ops/needs")
 OPS_PROPOSALS_DIR = env("OPS_PROPOSALS_DIR", "ops/proposals")
+
+# --- LLM cache ---
+# Opt-in (LLM_CACHE=1). Fila ligger utenfor repoet: workflowene kjører `git add -A`,
+# så en cache i outbox ville committet alle prompts og svar.
+# Semantisk cache koster et embeddings-kall per miss, så den er også opt-in.
+LLM_CACHE = env("LLM_CACHE", "0") == "1"
+LLM_CACHE_PATH = env(
+    "LLM_CACHE_PATH",
+    os.path.join(env("XDG_CACHE_HOME", os.path.expanduser("~/.cache")), "ida-mcp-gateway", "llm_cache.jsonl"),
+)
+LLM_CACHE_TTL_SEC = int(env("LLM_CACHE_TTL_SEC", "86400"))
+LLM_CACHE_MAX_ENTRIES = int(env("LLM_CACHE_MAX_ENTRIES", "1000"))
+# Kostnad per bom: ett embeddings-kall + et cosine-søk i ren Python (ca. 1536 gange per
+# innslag, i en tråd utenfor event loopen). Søket ser bare på de LLM_SEMANTIC_MAX_SCAN
+# nyeste innslagene, så det holder seg på noen få ms også med full cache.
+LLM_SEMANTIC_CACHE = env("LLM_SEMANTIC_CACHE", "0") == "1"
+LLM_SEMANTIC_MAX_SCAN = int(env("LLM_SEMANTIC_MAX_SCAN", "200"))
+LLM_SEMANTIC_THRESHOLD = float(env("LLM_SEMANTIC_THRESHOLD", "0.95"))
+OPENAI_EMBED_MODEL = env("OPENAI_EMBED_MODEL", "text-embedding-3-small")
@@ -1,8 +1,18 @@
 from __future__ import annotations
-import base64
-import json
 import requests
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Union
+
+try:
+    import pybase64 as base64  # type: ignore
+except Exception:
+    import base64
+
+
+def _b64(content: Union[str, bytes]) -> str:
+    # bytes går rett til base64 (ingen decode/encode-runde); str kodes som UTF-8
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    return base64.b64encode(content).decode("ascii")
 
 
 class GitHubAPI:
@@ -37,14 +47,14 @@ class GitHubAPI:
         self,
         repo: str,
         path: str,
-        content_text: str,
+        content_text: Union[str, bytes],
         message: str,
         branch: str = "main",
     ) -> Dict[str, Any]:
         url = f"{self.base}/repos/{repo}/contents/{path}"
 
         sha = self.get_file_sha(repo, path, branch=branch)
-        content_b64 = base64.b64encode(content_text.encode("utf-8")).decode("utf-8")
+        content_b64 = _b64(content_text)
 
         payload: Dict[str, Any] = {
             "message": message,
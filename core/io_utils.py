@@ -2,7 +2,12 @@ from __future__ import annotations
 import json
 import os
 from datetime import datetime, timezone
-from typing import Any, Dict
+from typing import Any, Dict, Union
+
+try:
+    import orjson  # type: ignore
+except Exception:
+    orjson = None
 
 
 def utc_now_iso() -> str:
@@ -13,6 +18,42 @@ def ensure_dir(path: str) -> None:
     os.makedirs(path, exist_ok=True)
 
 
+def dumps_json(obj: Any, *, indent: bool = False, sort_keys: bool = False) -> bytes:
+    # orjson gir ferdige UTF-8 bytes i ett pass; stdlib for det orjson nekter (f.eks. >64-bit int)
+    if orjson is not None:
+        opts = orjson.OPT_NON_STR_KEYS
+        if indent:
+            opts |= orjson.OPT_INDENT_2
+        if sort_keys:
+            opts |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, option=opts)
+        except TypeError:
+            pass
+    if indent:
+        return json.dumps(obj, ensure_ascii=False, indent=2, sort_keys=sort_keys).encode("utf-8")
+    return json.dumps(obj, ensure_ascii=False, separators=(",", ":"), sort_keys=sort_keys).encode("utf-8")
+
+
+def loads_json(raw: Union[bytes, str]) -> Any:
+    # orjson parser UTF-8-bytes direkte, uten mellomliggende str
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+
+def write_bytes(path: Union[str, "os.PathLike[str]"], data: bytes) -> None:
+    # rå os.open/os.write: ingen TextIOWrapper/BufferedWriter for ett ferdig payload.
+    # Mappa må finnes (kalleren lager den, evt. cachet).
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+
+
 def write_text(path: str, content: str) -> None:
     ensure_dir(os.path.dirname(path) or ".")
     with open(path, "w", encoding="utf-8") as f:
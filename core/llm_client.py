@@ -1,20 +1,241 @@
 from __future__ import annotations
-from typing import Any, Dict, Optional
+import asyncio
+import copy
+import hashlib
+import logging
+import math
+import operator
+import os
+import threading
+import time
+import weakref
+from typing import Any, Dict, List, Optional, Tuple
 
+from core.config import (
+    LLM_CACHE,
+    LLM_CACHE_MAX_ENTRIES,
+    LLM_CACHE_PATH,
+    LLM_CACHE_TTL_SEC,
+    LLM_SEMANTIC_CACHE,
+    LLM_SEMANTIC_MAX_SCAN,
+    LLM_SEMANTIC_THRESHOLD,
+)
+from core.io_utils import dumps_json, loads_json
 from providers.base import LLMProvider, LLMResponse
 from providers.openai_provider import OpenAIProvider
 
 
+# Én provider per event loop: kall i samme loop deler klient og connection pool,
+# mens AsyncOpenAI-poolen aldri brukes fra en annen loop enn den som lagde den.
+_PROVIDERS: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, LLMProvider]" = weakref.WeakKeyDictionary()
+
+
 def get_provider() -> LLMProvider:
     # Nå: kun OpenAI. Senere kan du mappe på PROVIDER env.
-    return OpenAIProvider()
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        # sync kaller uten loop: egen provider som ikke caches (kalleren eier og lukker den)
+        return OpenAIProvider()
+    p = _PROVIDERS.get(loop)
+    if p is None:
+        p = _PROVIDERS[loop] = OpenAIProvider()
+    return p
+
+
+async def close_provider() -> None:
+    """
+    Lukker provideren til loopen som kjører nå. Kall den før loopen avsluttes (f.eks.
+    sist i coroutinen som gis til asyncio.run); ellers kan httpx kaste
+    "Event loop is closed" når klienten garbage-collectes.
+    """
+    p = _PROVIDERS.pop(asyncio.get_running_loop(), None)
+    if p is not None:
+        await p.aclose()
+
+
+# --- Response cache -----------------------------------------------------------
+# To nivåer:
+#  1) exact: sha256(kind + system + prompt) -> svar (O(1) oppslag)
+#  2) semantisk (opt-in): cosine mot lagrede embeddings, treff hvis > terskel
+# Persisteres som JSON-linjer i LLM_CACHE_PATH slik at neste run gjenbruker.
+# Innslag eldre enn LLM_CACHE_TTL_SEC er bom; maks LLM_CACHE_MAX_ENTRIES (eldste kastes).
+
+_CACHE: Optional[Dict[str, Dict[str, Any]]] = None
+_CACHE_LOCK = threading.Lock()
+
+log = logging.getLogger(__name__)
+
+
+def _cache_key(kind: str, prompt: str, system: Optional[str]) -> str:
+    return hashlib.sha256(f"{kind}\0{system or ''}\0{prompt}".encode("utf-8")).hexdigest()
+
+
+def _fresh(entry: Dict[str, Any]) -> bool:
+    return time.time() - entry.get("ts", 0) < LLM_CACHE_TTL_SEC
+
+
+def _evict(cache: Dict[str, Dict[str, Any]]) -> None:
+    # dict er i innsettingsrekkefølge: første nøkkel er eldste innslag
+    while len(cache) > LLM_CACHE_MAX_ENTRIES:
+        del cache[next(iter(cache))]
+
+
+def _load_cache() -> Dict[str, Dict[str, Any]]:
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            cache: Dict[str, Dict[str, Any]] = {}
+            lines = 0
+            if LLM_CACHE_PATH:
+                try:
+                    with open(LLM_CACHE_PATH, "rb") as f:
+                        for line in f:
+                            lines += 1
+                            try:
+                                entry = loads_json(line)
+                                key = entry["key"]
+                            except Exception:
+                                # halvskrevet/korrupt linje: hopp over
+                                continue
+                            cache.pop(key, None)  # nyeste linje vinner og havner sist
+                            if _fresh(entry):
+                                cache[key] = entry
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    # uleselig fil: kjør videre med det vi fikk (eller tom cache), og ikke
+                    # komprimer – da kunne vi skrevet over innslag vi aldri fikk lest
+                    log.warning("LLM cache: kunne ikke lese %s: %s", LLM_CACHE_PATH, e)
+                    lines = 0
+            _evict(cache)
+            if len(cache) < lines:
+                _compact(cache)
+            _CACHE = cache
+    return _CACHE
+
+
+async def _get_cache() -> Dict[str, Dict[str, Any]]:
+    # første lesing av fila skjer i en tråd, så event loopen ikke blokkeres av disk-I/O
+    if _CACHE is not None:
+        return _CACHE
+    return await asyncio.to_thread(_load_cache)
 
 
-def llm_text(prompt: str, system: Optional[str] = None) -> LLMResponse:
+def _compact(cache: Dict[str, Dict[str, Any]]) -> None:
+    # skriv fila på nytt med bare gyldige innslag, så den ikke vokser uten grense
+    tmp = LLM_CACHE_PATH + ".tmp"
+    try:
+        with open(tmp, "wb") as f:
+            f.write(b"".join(dumps_json(e) + b"\n" for e in cache.values()))
+        os.replace(tmp, LLM_CACHE_PATH)
+    except OSError as e:
+        log.warning("LLM cache: kunne ikke komprimere %s: %s", LLM_CACHE_PATH, e)
+
+
+def _persist(entry: Dict[str, Any]) -> None:
+    # kalles etter et betalt API-kall: en disk-feil her skal aldri koste svaret
+    if not LLM_CACHE_PATH:
+        return
+    try:
+        os.makedirs(os.path.dirname(LLM_CACHE_PATH) or ".", exist_ok=True)
+        with open(LLM_CACHE_PATH, "ab") as f:
+            f.write(dumps_json(entry) + b"\n")
+    except OSError as e:
+        log.warning("LLM cache: kunne ikke skrive %s: %s", LLM_CACHE_PATH, e)
+
+
+def _normalize(vec: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vec))
+    return [x / norm for x in vec] if norm else vec
+
+
+def _semantic_lookup(kind: str, embedding: List[float]) -> Optional[Dict[str, Any]]:
+    # nyeste først, maks LLM_SEMANTIC_MAX_SCAN kandidater: søket er O(innslag x dimensjon)
+    best: Optional[Dict[str, Any]] = None
+    best_sim = LLM_SEMANTIC_THRESHOLD
+    scanned = 0
+    for entry in reversed(list(_load_cache().values())):
+        other = entry.get("embedding")
+        if entry.get("kind") != kind or not other or len(other) != len(embedding) or not _fresh(entry):
+            continue
+        # begge vektorene er normalisert -> dot product == cosine
+        sim = sum(map(operator.mul, embedding, other))
+        if sim > best_sim:
+            best, best_sim = entry, sim
+        scanned += 1
+        if scanned >= LLM_SEMANTIC_MAX_SCAN:
+            break
+    return best
+
+
+async def _cached(
+    kind: str, p: LLMProvider, prompt: str, system: Optional[str]
+) -> Tuple[Optional[Any], str, Optional[List[float]]]:
+    """
+    Returnerer (verdi, cache_hit, embedding).
+    cache_hit er "exact", "semantic" eller "" (bom). embedding er satt når det
+    semantiske nivået regnet ut en, så kalleren kan lagre den sammen med svaret.
+    """
+    if not LLM_CACHE:
+        return None, "", None
+
+    key = _cache_key(kind, prompt, system)
+    entry = (await _get_cache()).get(key)
+    if entry is not None and _fresh(entry):
+        # kopi: en kaller som endrer svaret (llm_json-dict) skal ikke ødelegge cachen
+        return copy.deepcopy(entry["value"]), "exact", None
+
+    if not LLM_SEMANTIC_CACHE:
+        return None, "", None
+
+    try:
+        embedding = _normalize(await p.embed(f"{system or ''}\n\n{prompt}"))
+        entry = await asyncio.to_thread(_semantic_lookup, kind, embedding)
+    except Exception:
+        # cachen er best-effort: feil embeddings-modell/kvote/nett = bom, ikke feil i selve kallet
+        return None, "", None
+    if entry is not None:
+        return copy.deepcopy(entry["value"]), "semantic", embedding
+    return None, "", embedding
+
+
+async def _store(kind: str, prompt: str, system: Optional[str], value: Any, embedding: Optional[List[float]]) -> None:
+    if not LLM_CACHE or not (value.strip() if isinstance(value, str) else value):
+        # tomme svar caches ikke – de skal ikke serveres som treff senere
+        return
+    entry: Dict[str, Any] = {
+        "key": _cache_key(kind, prompt, system),
+        "kind": kind,
+        "ts": time.time(),
+        "value": copy.deepcopy(value),
+    }
+    if embedding:
+        entry["embedding"] = embedding
+    cache = await _get_cache()
+    cache.pop(entry["key"], None)
+    cache[entry["key"]] = entry
+    _evict(cache)
+    await asyncio.to_thread(_persist, entry)
+
+
+async def llm_text(prompt: str, system: Optional[str] = None) -> LLMResponse:
     p = get_provider()
-    return p.generate(prompt, system=system)
+    hit, how, embedding = await _cached("text", p, prompt, system)
+    if hit is not None:
+        return LLMResponse(text=hit, raw={"cache": how})
 
+    resp = await p.generate(prompt, system=system)
+    await _store("text", prompt, system, resp.text, embedding)
+    return resp
 
-def llm_json(prompt: str, system: Optional[str] = None) -> Dict[str, Any]:
+
+async def llm_json(prompt: str, system: Optional[str] = None) -> Dict[str, Any]:
     p = get_provider()
-    return p.json(prompt, system=system)
+    hit, _how, embedding = await _cached("json", p, prompt, system)
+    if hit is not None:
+        return hit
+
+    out = await p.json(prompt, system=system)
+    await _store("json", prompt, system, out, embedding)
+    return out
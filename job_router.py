@@ -1,17 +1,52 @@
 from __future__ import annotations
 
-from worker.roi_scan import handle_roi_scan
+from typing import Any, Callable, Dict
 
+from worker.roi_scan import run as run_roi_scan
 
-def dispatch(job: dict, needs: dict) -> dict:
-    job_type = (job.get("job_type") or "").strip().upper()
 
-    if job_type == "ROI_SCAN":
-        return handle_roi_scan(job, needs)
+def handle_roi_scan(job: dict, needs: dict) -> dict:
+    # worker.roi_scan.run takes only the job; ROI_SCAN has no use for needs
+    return run_roi_scan(job)
+
+
+DISPATCH: Dict[str, Callable[[dict, dict], dict]] = {
+    "ROI_SCAN": handle_roi_scan,
+}
+
+
+def _normalize_job_type(raw_type: str) -> str:
+    return raw_type.strip().upper()
+
 
+def _detect_job_type(job: dict) -> str:
+    # Accept multiple schema variants:
+    # - job_type (preferred)
+    # - task (what the generator currently emits)
+    # - type  (older/alternate)
+    raw_type: Any = (
+        job.get("job_type")
+        or job.get("task")
+        or job.get("type")
+        or ""
+    )
+    return _normalize_job_type(str(raw_type))
+
+
+def _needs_input(job: dict, job_type: str) -> dict:
     return {
         "job_id": job.get("job_id", "unknown"),
         "job_type": job_type,
         "status": "FAILED",
-        "reason": f"Unknown job type: {job_type}",
+        "reason": f"Unknown job type: {job_type!r}. Expected one of: {', '.join(DISPATCH)}",
+        "details": {
+            "seen_keys": sorted(list(job.keys()))[:50],
+            "hint": "Provide job_type (preferred) or task/type in the job JSON.",
+        },
     }
+
+
+def dispatch(job: dict, needs: dict) -> dict:
+    job_type = _detect_job_type(job)
+    fn = DISPATCH.get(job_type)
+    return fn(job, needs) if fn else _needs_input(job, job_type)
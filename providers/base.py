@@ -1,6 +1,6 @@
 from __future__ import annotations
 from dataclasses import dataclass
-from typing import Any, Dict, Optional, Protocol
+from typing import Any, Dict, List, Optional, Protocol
 
 
 @dataclass
@@ -12,8 +12,14 @@ class LLMResponse:
 class LLMProvider(Protocol):
     name: str
 
-    def generate(self, prompt: str, *, system: str | None = None) -> LLMResponse:
+    async def generate(self, prompt: str, *, system: str | None = None) -> LLMResponse:
         ...
 
-    def json(self, prompt: str, *, system: str | None = None) -> Dict[str, Any]:
+    async def embed(self, text: str) -> List[float]:
+        ...
+
+    async def json(self, prompt: str, *, system: str | None = None) -> Dict[str, Any]:
+        ...
+
+    async def aclose(self) -> None:
         ...
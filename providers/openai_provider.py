@@ -1,9 +1,10 @@
 from __future__ import annotations
+import asyncio
 import json
-from typing import Any, Dict, Optional
+from typing import Any, Dict, List, Optional
 
-from core.config import OPENAI_API_KEY, OPENAI_MODEL
-from providers.base import LLMProvider, LLMResponse
+from core.config import OPENAI_API_KEY, OPENAI_EMBED_MODEL, OPENAI_MODEL
+from providers.base import LLMResponse
 
 
 class OpenAIProvider:
@@ -16,11 +17,11 @@ class OpenAIProvider:
             )
 
         # Lazy import så systemet ikke crasher ved import hvis pakken mangler.
-        from openai import OpenAI  # type: ignore
-        self._client = OpenAI(api_key=OPENAI_API_KEY)
+        from openai import AsyncOpenAI  # type: ignore
+        self._client = AsyncOpenAI(api_key=OPENAI_API_KEY)
         self._model = OPENAI_MODEL or "gpt-4.1-mini"
 
-    def generate(self, prompt: str, *, system: Optional[str] = None) -> LLMResponse:
+    async def generate(self, prompt: str, *, system: Optional[str] = None) -> LLMResponse:
         messages = []
         if system:
             messages.append({"role": "system", "content": system})
@@ -29,7 +30,7 @@ class OpenAIProvider:
         # Bruk Responses API hvis tilgjengelig i din openai lib.
         # Hvis ikke: bytt til chat.completions. Dette fungerer for de fleste nye versjoner.
         try:
-            resp = self._client.responses.create(
+            resp = await self._client.responses.create(
                 model=self._model,
                 input=messages,
             )
@@ -44,7 +45,7 @@ class OpenAIProvider:
             return LLMResponse(text=text, raw={"responses": True})
         except Exception:
             # Fallback til chat.completions
-            resp2 = self._client.chat.completions.create(
+            resp2 = await self._client.chat.completions.create(
                 model=self._model,
                 messages=messages,
                 temperature=0.2,
@@ -52,11 +53,23 @@ class OpenAIProvider:
             text2 = resp2.choices[0].message.content or ""
             return LLMResponse(text=text2, raw={"responses": False})
 
-    def json(self, prompt: str, *, system: Optional[str] = None) -> Dict[str, Any]:
-        out = self.generate(
+    async def aclose(self) -> None:
+        # Lukk klientens connection pool mens loopen den hører til fortsatt kjører.
+        await self._client.close()
+
+    async def embed(self, text: str) -> List[float]:
+        resp = await self._client.embeddings.create(
+            model=OPENAI_EMBED_MODEL or "text-embedding-3-small",
+            input=text,
+        )
+        return list(resp.data[0].embedding)
+
+    async def json(self, prompt: str, *, system: Optional[str] = None) -> Dict[str, Any]:
+        resp = await self.generate(
             prompt,
             system=(system or "") + "\n\nSvar KUN med gyldig JSON. Ingen tekst utenfor JSON.",
-        ).text.strip()
+        )
+        out = resp.text.strip()
 
         # Hard parse: hvis modellen tuller → fail tydelig
         try:
@@ -66,22 +79,33 @@ class OpenAIProvider:
             # --- Compatibility wrapper for worker imports -------------------------------
 # Some workers import: from providers.openai_provider import ask_openai
 # Provide a simple function wrapper around OpenAIProvider.
-
-_provider_singleton: OpenAIProvider | None = None
+# Sync callers only: inside a running event loop (e.g. the FastAPI app) await
+# OpenAIProvider().generate(...) or core.llm_client.llm_text instead.
 
 
-def _get_provider() -> OpenAIProvider:
-    global _provider_singleton
-    if _provider_singleton is None:
-        _provider_singleton = OpenAIProvider()
-    return _provider_singleton
+async def _ask(prompt: str, system: str | None) -> str:
+    prov = OpenAIProvider()
+    try:
+        return (await prov.generate(prompt=prompt, system=system)).text
+    finally:
+        await prov.aclose()
 
 
 def ask_openai(prompt: str, system: str | None = None) -> str:
     """
     Backwards-compatible helper used by workers.
     Returns plain text.
-    """
-    prov = _get_provider()
-    return prov.generate(prompt=prompt, system=system).text
 
+    Runs its own event loop, so it builds a fresh provider per call (the
+    async client's connection pool is bound to the loop that created it)
+    and closes it before the loop is torn down.
+    Raises RuntimeError when called from a running event loop.
+    """
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(_ask(prompt, system))
+    raise RuntimeError(
+        "ask_openai() er sync og kan ikke kalles fra en kjørende event loop; "
+        "bruk await OpenAIProvider().generate(...) eller core.llm_client.llm_text."
+    )
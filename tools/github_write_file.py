@@ -1,6 +1,10 @@
 import os
 import requests
-import base64
+
+try:
+    import pybase64 as base64  # SIMD base64, drop-in API
+except Exception:
+    import base64
 
 TOOL_SPEC = {
     "name": "github_write_file",
@@ -2,11 +2,39 @@
 from __future__ import annotations
 from dataclasses import dataclass
 from typing import Any, Dict, Optional
-import json
+
+from core.io_utils import loads_json
+
+try:
+    import fastjsonschema  # type: ignore
+except Exception:
+    fastjsonschema = None
 
 REQUIRED_TOP_KEYS = {"id", "type", "payload"}
 OPTIONAL_TOP_KEYS = {"output", "meta"}
 
+_NON_EMPTY_STRING = {"type": "string", "pattern": "\\S"}
+
+JOB_SCHEMA: Dict[str, Any] = {
+    "type": "object",
+    "required": sorted(REQUIRED_TOP_KEYS),
+    "additionalProperties": False,
+    "properties": {
+        "id": _NON_EMPTY_STRING,
+        "type": _NON_EMPTY_STRING,
+        "payload": {"type": "object"},
+        "output": {
+            "type": ["object", "null"],
+            "properties": {"path": _NON_EMPTY_STRING},
+        },
+        "meta": {"type": ["object", "null"]},
+    },
+}
+
+# Compiled once at import; parse_job falls back to the hand-rolled checks
+# below when fastjsonschema is not installed.
+_VALIDATE = fastjsonschema.compile(JOB_SCHEMA) if fastjsonschema is not None else None
+
 @dataclass
 class Job:
     id: str
@@ -22,7 +50,7 @@ def _assert(cond: bool, msg: str) -> None:
     if not cond:
         raise JobSchemaError(msg)
 
-def parse_job(raw: Dict[str, Any]) -> Job:
+def _check_job(raw: Dict[str, Any]) -> None:
     _assert(isinstance(raw, dict), "Job must be a JSON object")
 
     keys = set(raw.keys())
@@ -52,15 +80,24 @@ def parse_job(raw: Dict[str, Any]) -> Job:
     if meta is not None:
         _assert(isinstance(meta, dict), "meta must be an object if present")
 
+def parse_job(raw: Dict[str, Any]) -> Job:
+    if _VALIDATE is not None:
+        try:
+            _VALIDATE(raw)
+        except fastjsonschema.JsonSchemaException as e:
+            raise JobSchemaError(str(e)) from e
+    else:
+        _check_job(raw)
+
     return Job(
-        id=job_id.strip(),
-        type=job_type.strip(),
-        payload=payload,
-        output=output,
-        meta=meta,
+        id=raw["id"].strip(),
+        type=raw["type"].strip(),
+        payload=raw["payload"],
+        output=raw.get("output"),
+        meta=raw.get("meta"),
     )
 
 def load_job_from_file(path: str) -> Job:
-    with open(path, "r", encoding="utf-8") as f:
-        raw = json.load(f)
+    with open(path, "rb") as f:
+        raw = loads_json(f.read())
     return parse_job(raw)
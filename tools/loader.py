@@ -1,6 +1,8 @@
 import importlib
 import pkgutil
 
+_CACHE = None
+
 def load_tools():
     """
     Auto-discover tool modules inside tools/ package.
@@ -8,7 +10,13 @@ def load_tools():
       - TOOL_NAME (str)
       - TOOL_SPEC (dict)  (MCP-style tool schema)
       - run(args: dict) -> dict
+
+    Discovery runs once per process; later calls return the cached result.
     """
+    global _CACHE
+    if _CACHE is not None:
+        return _CACHE
+
     from . import ping  # ensures at least one tool exists (safety)
 
     tools = {}
@@ -34,4 +42,5 @@ def load_tools():
         tools[tool_name] = runner
         specs[tool_name] = tool_spec
 
-    return tools, specs
+    _CACHE = (tools, specs)
+    return _CACHE
@@ -1,13 +1,30 @@
 import os
-import json
+import atexit
 import time
 import datetime
 import hashlib
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from urllib.parse import urlparse
 
 import requests
 from bs4 import BeautifulSoup
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from core.io_utils import dumps_json, loads_json
+
+try:
+    from selectolax.lexbor import LexborHTMLParser  # type: ignore
+except Exception:
+    LexborHTMLParser = None
+
+try:
+    from blake3 import blake3  # type: ignore
+except Exception:
+    blake3 = None
 
 ROOT = Path(__file__).resolve().parents[1]
 
@@ -26,9 +43,29 @@ SERPER_API_KEY = os.getenv("SERPER_API_KEY", "").strip()
 FETCH_TIMEOUT_SECONDS = int(os.getenv("FETCH_TIMEOUT_SECONDS", "25"))
 FETCH_MAX_BYTES = int(os.getenv("FETCH_MAX_BYTES", "1500000"))
 USER_AGENT = os.getenv("USER_AGENT", "IDA-MCP-Gateway/1.0")
+FETCH_CONCURRENCY = max(1, int(os.getenv("FETCH_CONCURRENCY", "4")))
+
+# Debug switches: pretty-printed JSON and the full Serper payload cost CPU and disk.
+JSON_PRETTY = os.getenv("OUTBOX_JSON_PRETTY", "0") == "1"
+SERPER_KEEP_RAW = os.getenv("SERPER_KEEP_RAW", "0") == "1"
 
 SERPER_ENDPOINT = "https://google.serper.dev/search"
 
+# One session per thread: keep-alive + pooled connections, so repeated calls to the
+# same host (Serper, or several FETCH_URL jobs on one site) skip the TCP/TLS handshake.
+# requests.Session is not thread-safe, so the fetch pool threads don't share one.
+_LOCAL = threading.local()
+
+def _session() -> requests.Session:
+    session = getattr(_LOCAL, "session", None)
+    if session is None:
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=16, pool_maxsize=32, max_retries=Retry(total=2, backoff_factor=0.3))
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        _LOCAL.session = session
+    return session
+
 def ensure_dirs():
     for d in [OUTBOX_DIR, DONE_DIR, RESULTS_DIR, LOGS_DIR, NEEDS_DIR]:
         d.mkdir(parents=True, exist_ok=True)
@@ -45,63 +82,125 @@ def load_allowed_domains():
         domains.add(line.lower())
     return domains
 
+def _host(url: str) -> str:
+    # Fast path for plain scheme://[user@]host[:port]/... URLs; anything odd
+    # (escapes, non-ASCII, whitespace, backslashes, no scheme) goes to urlparse
+    i = url.find("://")
+    if i <= 0 or not url.isascii() or not url.isprintable() or any(c in url for c in "% \\"):
+        return (urlparse(url).hostname or "").lower()
+    start = i + 3
+    end = len(url)
+    for sep in "/?#":
+        j = url.find(sep, start)
+        if 0 <= j < end:
+            end = j
+    hp = url[start:end]
+    hp = hp[hp.rfind("@") + 1:]
+    if hp.startswith("["):
+        close = hp.find("]")
+        return hp[1:close].lower() if close > 0 else ""
+    col = hp.find(":")
+    return (hp[:col] if col >= 0 else hp).lower()
+
 def is_domain_allowed(url: str, allowed_domains: set) -> tuple[bool, str]:
     try:
-        parsed = urlparse(url)
-        host = (parsed.hostname or "").lower()
+        host = _host(url)
         if not host:
             return False, ""
-        # allow exact match or subdomain of listed domain
-        for d in allowed_domains:
-            if host == d or host.endswith("." + d):
+        # allow exact match or subdomain of listed domain: walk the host's
+        # parent suffixes (a.b.c -> b.c -> c) with set lookups instead of
+        # scanning the whole allow-list per URL
+        suffix = host
+        while True:
+            if suffix in allowed_domains:
                 return True, host
-        return False, host
+            dot = suffix.find(".")
+            if dot < 0:
+                return False, host
+            suffix = suffix[dot + 1:]
     except Exception:
         return False, ""
 
-def now_iso():
-    return datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
+def _now() -> tuple[str, str, str]:
+    # One clock read, formatted by hand (strftime reparses its format every call).
+    # Returns (iso "YYYY-MM-DDTHH:MM:SSZ", date "YYYY-MM-DD", compact "YYYYMMDDTHHMMSSZ").
+    dt = datetime.datetime.utcnow()
+    date = f"{dt.year:04d}-{dt.month:02d}-{dt.day:02d}"
+    hms = f"{dt.hour:02d}:{dt.minute:02d}:{dt.second:02d}"
+    compact = f"{dt.year:04d}{dt.month:02d}{dt.day:02d}T{dt.hour:02d}{dt.minute:02d}{dt.second:02d}Z"
+    return f"{date}T{hms}Z", date, compact
 
-def sha1(s: str) -> str:
-    return hashlib.sha1(s.encode("utf-8")).hexdigest()
+def now_iso():
+    return _now()[0]
+
+def derive_job_id(job: dict) -> str:
+    # Fallback id for jobs without job_id: hash of the canonical (sorted-key) JSON bytes.
+    buf = dumps_json(job, sort_keys=True)
+    if blake3 is not None:
+        return blake3(buf).hexdigest(16)
+    return hashlib.blake2b(buf, digest_size=16).hexdigest()
+
+# Ops log entries are buffered per date and written with one open/append per
+# daily file: at the end of main() and, as a safety net, at interpreter exit.
+# The lock keeps each entry contiguous when FETCH_URL jobs log from worker threads.
+_OPS_LOG_BUF: dict[str, list[str]] = {}
+_OPS_LOG_LOCK = threading.Lock()
+
+def flush_ops_log():
+    with _OPS_LOG_LOCK:
+        pending = list(_OPS_LOG_BUF.items())
+        _OPS_LOG_BUF.clear()
+    for date_str, buf in pending:
+        log_path = LOGS_DIR / f"{date_str}.md"
+        header = f"# IDA ops log {date_str}\n\n" if not log_path.exists() else ""
+        with log_path.open("a", encoding="utf-8") as f:
+            f.write(header + "".join(buf))
+
+atexit.register(flush_ops_log)
 
 def append_ops_log(lines: list[str]):
-    date_str = datetime.datetime.utcnow().strftime("%Y-%m-%d")
-    log_path = LOGS_DIR / f"{date_str}.md"
-    header = f"# IDA ops log {date_str}\n\n" if not log_path.exists() else ""
-    with log_path.open("a", encoding="utf-8") as f:
-        if header:
-            f.write(header)
-        for ln in lines:
-            f.write(ln.rstrip() + "\n")
-        f.write("\n")
+    date_str = _now()[1]
+    entry = "".join(ln.rstrip() + "\n" for ln in lines) + "\n"
+    with _OPS_LOG_LOCK:
+        _OPS_LOG_BUF.setdefault(date_str, []).append(entry)
 
 def read_job(path: Path) -> dict:
-    return json.loads(path.read_text(encoding="utf-8"))
+    return loads_json(path.read_bytes())
 
 def write_json(path: Path, obj: dict):
     path.parent.mkdir(parents=True, exist_ok=True)
-    path.write_text(json.dumps(obj, ensure_ascii=False, indent=2), encoding="utf-8")
+    path.write_bytes(dumps_json(obj, indent=JSON_PRETTY))
 
 def write_text(path: Path, text: str):
     path.parent.mkdir(parents=True, exist_ok=True)
     path.write_text(text, encoding="utf-8")
 
-def list_jobs_fifo() -> list[Path]:
-    if not OUTBOX_DIR.exists():
+def list_jobs_fifo(limit: int | None = None) -> list[Path]:
+    # scandir: is_file() comes from the directory read, so one stat per job instead of two
+    try:
+        with os.scandir(OUTBOX_DIR) as it:
+            entries = [
+                (e.stat().st_mtime, e.name)
+                for e in it
+                if e.name.endswith(".json") and not e.name.startswith(".") and e.is_file()
+            ]
+    except FileNotFoundError:
         return []
-    jobs = [p for p in OUTBOX_DIR.glob("*.json") if p.is_file()]
     # FIFO: oldest mtime first, then name
-    jobs.sort(key=lambda p: (p.stat().st_mtime, p.name))
-    return jobs
+    entries.sort()
+    return [OUTBOX_DIR / name for _, name in entries[:limit]]
 
 def move_to_done(job_path: Path, status: str):
     DONE_DIR.mkdir(parents=True, exist_ok=True)
-    ts = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+    ts = _now()[2]
     done_name = f"{job_path.stem}.{status}.{ts}.json"
     dest = DONE_DIR / done_name
-    dest.write_text(job_path.read_text(encoding="utf-8"), encoding="utf-8")
-    job_path.unlink(missing_ok=True)
+    try:
+        # same filesystem: atomic rename, no read/write of the job body
+        os.replace(job_path, dest)
+    except OSError:
+        # e.g. outbox and done on different devices
+        shutil.move(str(job_path), str(dest))
 
 def mark_need(job_id: str, reason: str, details: dict | None = None):
     payload = {
@@ -124,9 +223,9 @@ def serper_search(query: str, num_results: int = 10, recency_days: int | None =
     payload = {"q": query}
     # Serper supports different params, but keep minimal and robust.
     # recency_days not guaranteed across all modes; we store it as metadata.
-    resp = requests.post(SERPER_ENDPOINT, headers=headers, json=payload, timeout=25)
+    resp = _session().post(SERPER_ENDPOINT, headers=headers, json=payload, timeout=25)
     resp.raise_for_status()
-    data = resp.json()
+    data = loads_json(resp.content)
 
     # Normalize top results (organic)
     organic = data.get("organic", []) or []
@@ -140,59 +239,97 @@ def serper_search(query: str, num_results: int = 10, recency_days: int | None =
             "position": r.get("position"),
         })
 
-    return {
+    out = {
         "query": query,
         "requested_num_results": num_results,
         "recency_days": recency_days,
         "results": normalized,
-        "raw": data,
         "timestamp": now_iso(),
     }
+    if SERPER_KEEP_RAW:
+        out["raw"] = data
+    return out
 
-def fetch_url_text(url: str) -> dict:
+JUNK_TAGS = ["script", "style", "noscript", "svg"]
+
+def html_to_text(html: str) -> str:
+    # selectolax (lexbor, C) first: several times faster than building a BeautifulSoup tree
+    if LexborHTMLParser is not None:
+        try:
+            tree = LexborHTMLParser(html)
+            for node in tree.css(",".join(JUNK_TAGS)):
+                node.decompose()
+            return tree.root.text(separator="\n", strip=True) if tree.root is not None else ""
+        except Exception:
+            pass
+    soup = BeautifulSoup(html, "lxml")
+    # Remove obvious junk
+    for tag in soup(JUNK_TAGS):
+        tag.decompose()
+    return soup.get_text("\n", strip=True)
+
+def fetch_url_to(url: str, text_out: Path) -> dict:
+    """
+    Fetch url and write its text to text_out, reading at most FETCH_MAX_BYTES.
+    HTML is decoded and reduced to text; anything else is streamed to disk as
+    served, without a decode/encode round trip. Returns the fetch metadata.
+    """
     headers = {"User-Agent": USER_AGENT}
-    resp = requests.get(url, headers=headers, timeout=FETCH_TIMEOUT_SECONDS, stream=True)
-    status_code = resp.status_code
-
-    # Read limited bytes
-    content = b""
-    for chunk in resp.iter_content(chunk_size=65536):
-        if not chunk:
-            break
-        content += chunk
-        if len(content) > FETCH_MAX_BYTES:
-            break
-
-    content_type = resp.headers.get("Content-Type", "")
-    # Try decode
-    encoding = resp.encoding or "utf-8"
+    resp = _session().get(url, headers=headers, timeout=FETCH_TIMEOUT_SECONDS, stream=True)
     try:
-        html = content.decode(encoding, errors="replace")
-    except Exception:
-        html = content.decode("utf-8", errors="replace")
-
-    text = ""
-    if "html" in content_type.lower() or "<html" in html.lower():
-        soup = BeautifulSoup(html, "lxml")
-        # Remove obvious junk
-        for tag in soup(["script", "style", "noscript", "svg"]):
-            tag.decompose()
-        text = soup.get_text("\n", strip=True)
-    else:
-        # plain text or other
-        text = html.strip()
+        status_code = resp.status_code
+        content_type = resp.headers.get("Content-Type", "")
+        chunks = resp.iter_content(chunk_size=65536)
+        first = next(chunks, b"")[:FETCH_MAX_BYTES]
+
+        if "html" in content_type.lower() or b"<html" in first.lower():
+            # Read limited bytes (bytearray grows in place; bytes += would recopy every chunk)
+            content = bytearray(first)
+            extend = content.extend
+            for chunk in chunks:
+                if len(content) >= FETCH_MAX_BYTES:
+                    break
+                if not chunk:
+                    break
+                extend(chunk)
+            del content[FETCH_MAX_BYTES:]
+            bytes_read = len(content)
+
+            # Try decode
+            encoding = resp.encoding or "utf-8"
+            try:
+                html = content.decode(encoding, errors="replace")
+            except Exception:
+                html = content.decode("utf-8", errors="replace")
+            write_text(text_out, html_to_text(html))
+        else:
+            # plain text or other: copy the capped byte stream straight to disk
+            text_out.parent.mkdir(parents=True, exist_ok=True)
+            bytes_read = len(first)
+            with open(text_out, "wb") as f:
+                f.write(first)
+                for chunk in chunks:
+                    if bytes_read >= FETCH_MAX_BYTES:
+                        break
+                    if not chunk:
+                        break
+                    chunk = chunk[:FETCH_MAX_BYTES - bytes_read]
+                    f.write(chunk)
+                    bytes_read += len(chunk)
+    finally:
+        # streamed responses only go back to the session pool once closed
+        resp.close()
 
     return {
         "url": url,
         "status_code": status_code,
         "content_type": content_type,
-        "bytes_read": len(content),
+        "bytes_read": bytes_read,
         "fetched_at": now_iso(),
-        "text": text,
     }
 
 def handle_web_search(job: dict):
-    job_id = job.get("job_id") or sha1(json.dumps(job, sort_keys=True))
+    job_id = job.get("job_id") or derive_job_id(job)
     query = job.get("query", "").strip()
     num_results = int(job.get("num_results", 10))
     recency_days = job.get("recency_days", None)
@@ -217,7 +354,7 @@ def handle_web_search(job: dict):
     return job_id, "OK"
 
 def handle_fetch_url(job: dict, allowed_domains: set):
-    job_id = job.get("job_id") or sha1(json.dumps(job, sort_keys=True))
+    job_id = job.get("job_id") or derive_job_id(job)
     url = job.get("url", "").strip()
 
     if not url:
@@ -236,13 +373,11 @@ def handle_fetch_url(job: dict, allowed_domains: set):
         ])
         return job_id, "BLOCKED"
 
-    fetched = fetch_url_text(url)
     text_out = RESULTS_DIR / f"{job_id}_content.txt"
     meta_out = RESULTS_DIR / f"{job_id}_meta.json"
 
-    write_text(text_out, fetched["text"])
-    meta = {k: fetched[k] for k in ["url", "status_code", "content_type", "bytes_read", "fetched_at"]}
-    write_json(meta_out, meta)
+    fetched = fetch_url_to(url, text_out)
+    write_json(meta_out, fetched)
 
     append_ops_log([
         f"## FETCH_URL",
@@ -258,56 +393,81 @@ def handle_fetch_url(job: dict, allowed_domains: set):
 
     return job_id, "OK"
 
+def fail_job(job_path: Path, e: Exception):
+    # never crash the whole run because of one job
+    job_id = job_path.stem
+    mark_need(job_id, "Runner exception", {"error": str(e), "file": job_path.name})
+    append_ops_log([
+        f"## ERROR",
+        f"- job_id: `{job_id}`",
+        f"- file: `{job_path.as_posix()}`",
+        f"- error: `{str(e)}`",
+        f"- status: FAILED (job skipped, runner continues)",
+    ])
+    move_to_done(job_path, "FAILED")
+
+def run_job(job_path: Path, job: dict, handlers: dict, job_type: str) -> bool:
+    try:
+        handler = handlers.get(job_type)
+        if handler is not None:
+            job_id, status = handler(job)
+        else:
+            job_id = job.get("job_id") or job_path.stem
+            mark_need(job_id, "Unknown job type", {"type": job.get("type"), "supported": list(handlers)})
+            append_ops_log([
+                f"## UNKNOWN_JOB",
+                f"- job_id: `{job_id}`",
+                f"- file: `{job_path.as_posix()}`",
+                f"- type: `{job.get('type')}`",
+                f"- status: FAILED",
+            ])
+            status = "FAILED"
+
+        move_to_done(job_path, status)
+        return True
+
+    except Exception as e:
+        fail_job(job_path, e)
+        return False
+
 def main():
     ensure_dirs()
     allowed_domains = load_allowed_domains()
+    handlers = {
+        "WEB_SEARCH": handle_web_search,
+        "FETCH_URL": lambda job: handle_fetch_url(job, allowed_domains),
+    }
 
-    jobs = list_jobs_fifo()
+    jobs = list_jobs_fifo(limit=MAX_JOBS_PER_RUN)
     if not jobs:
         append_ops_log([f"## RUN", f"- {now_iso()} no jobs in outbox"])
+        flush_ops_log()
         return
 
     processed = 0
-    for job_path in jobs[:MAX_JOBS_PER_RUN]:
-        try:
-            job = read_job(job_path)
-            job_type = (job.get("type") or "").strip().upper()
-
-            if job_type == "WEB_SEARCH":
-                job_id, status = handle_web_search(job)
-            elif job_type == "FETCH_URL":
-                job_id, status = handle_fetch_url(job, allowed_domains)
-            else:
-                job_id = job.get("job_id") or job_path.stem
-                mark_need(job_id, "Unknown job type", {"type": job.get("type"), "supported": ["WEB_SEARCH", "FETCH_URL"]})
-                append_ops_log([
-                    f"## UNKNOWN_JOB",
-                    f"- job_id: `{job_id}`",
-                    f"- file: `{job_path.as_posix()}`",
-                    f"- type: `{job.get('type')}`",
-                    f"- status: FAILED",
-                ])
-                status = "FAILED"
-
-            move_to_done(job_path, status)
-            processed += 1
+    futures = []
+    # Jobs are started in FIFO order. FETCH_URL is network-bound and has no shared
+    # rate limit, so it runs on the pool while later jobs go on; fetches may
+    # therefore finish (and log) after jobs queued behind them.
+    with ThreadPoolExecutor(max_workers=FETCH_CONCURRENCY) as pool:
+        for job_path in jobs:
+            try:
+                job = read_job(job_path)
+                job_type = (job.get("type") or "").strip().upper()
+            except Exception as e:
+                fail_job(job_path, e)
+                continue
+
+            if job_type == "FETCH_URL":
+                futures.append(pool.submit(run_job, job_path, job, handlers, job_type))
+                continue
+
+            processed += run_job(job_path, job, handlers, job_type)
 
             # be nice to rate limits
             time.sleep(1.0)
 
-        except Exception as e:
-            # never crash the whole run because of one job
-            job_id = job_path.stem
-            mark_need(job_id, "Runner exception", {"error": str(e), "file": job_path.name})
-            append_ops_log([
-                f"## ERROR",
-                f"- job_id: `{job_id}`",
-                f"- file: `{job_path.as_posix()}`",
-                f"- error: `{str(e)}`",
-                f"- status: FAILED (job skipped, runner continues)",
-            ])
-            move_to_done(job_path, "FAILED")
-            continue
+        processed += sum(f.result() for f in futures)
 
     append_ops_log([
         f"## RUN_SUMMARY",
@@ -315,6 +475,7 @@ def main():
         f"- processed: {processed}",
         f"- max_per_run: {MAX_JOBS_PER_RUN}",
     ])
+    flush_ops_log()
 
 if __name__ == "__main__":
     main()
@@ -1,4 +1,5 @@
 from __future__ import annotations
+import asyncio
 import os
 import traceback
 from datetime import datetime, timezone
@@ -6,7 +7,7 @@ from datetime import datetime, timezone
 from core.config import OUTBOX_DIR, RESULTS_DIR, OPS_LOG_DIR, MAX_JOBS_PER_RUN
 from core.io_utils import ensure_dir, read_json, write_json, write_text, utc_now_iso
 from core.job_schema import Job
-from core.llm_client import llm_text
+from core.llm_client import close_provider, llm_text
 
 
 SYSTEM_CORE = """\
@@ -34,7 +35,7 @@ def log_ops(line: str) -> None:
         f.write(f"- [{prefix}Z] {line}\n")
 
 
-def run_job(job_path: str) -> None:
+async def run_job(job_path: str) -> None:
     raw = read_json(job_path)
     job = Job.from_dict(raw)
 
@@ -54,7 +55,7 @@ Leveransekrav:
 - Output skal være ren markdown, ingen bullshit.
 """
 
-    result = llm_text(prompt, system=SYSTEM_CORE).text
+    result = (await llm_text(prompt, system=SYSTEM_CORE)).text
 
     ensure_dir(RESULTS_DIR)
     out_md = os.path.join(RESULTS_DIR, f"{job.job_id}_output.md")
@@ -79,23 +80,32 @@ def main() -> None:
     # SAFE MODE: 1 jobb per run
     to_run = jobs[: max(1, MAX_JOBS_PER_RUN)]
 
-    for job_path in to_run:
-        try:
-            run_job(job_path)
-        except Exception as e:
-            tb = traceback.format_exc()
-            # marker failed
+    asyncio.run(_run_jobs(to_run))
+
+
+async def _run_jobs(to_run: list[str]) -> None:
+    # Én event loop for hele runnen: alle jobbene deler samme klient/connection pool,
+    # som lukkes én gang til slutt (før asyncio.run river ned loopen).
+    try:
+        for job_path in to_run:
             try:
-                raw = read_json(job_path)
-                job = Job.from_dict(raw)
-                job.status = "failed"
-                job.updated_at = utc_now_iso()
-                write_json(job_path, job.to_dict())
-            except Exception:
-                pass
-            log_ops(f"JOB failed: {os.path.basename(job_path)} error={e}")
-            ensure_dir(RESULTS_DIR)
-            write_text(os.path.join(RESULTS_DIR, f"{os.path.basename(job_path)}.error.txt"), tb)
+                await run_job(job_path)
+            except Exception as e:
+                tb = traceback.format_exc()
+                # marker failed
+                try:
+                    raw = read_json(job_path)
+                    job = Job.from_dict(raw)
+                    job.status = "failed"
+                    job.updated_at = utc_now_iso()
+                    write_json(job_path, job.to_dict())
+                except Exception:
+                    pass
+                log_ops(f"JOB failed: {os.path.basename(job_path)} error={e}")
+                ensure_dir(RESULTS_DIR)
+                write_text(os.path.join(RESULTS_DIR, f"{os.path.basename(job_path)}.error.txt"), tb)
+    finally:
+        await close_provider()
 
 
 if __name__ == "__main__":
@@ -9,20 +9,95 @@ IDA Outbox Worker
 """
 
 import os
-import sys
+import errno
 import json
-import time
 import glob
 import shutil
 import hashlib
+import functools
+import math
+import re
+import threading
+import time
 import datetime as dt
-from typing import Any, Dict, Optional, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, Optional, Tuple, Union
 
 try:
     import requests  # type: ignore
+    from requests.adapters import HTTPAdapter  # type: ignore
+    from urllib3.util.retry import Retry  # type: ignore
 except Exception:
     requests = None
 
+from core.io_utils import dumps_json, loads_json
+
+
+def _build_session():
+    """
+    One pooled Session for the whole run: jobs reuse the TCP/TLS connection to
+    the API instead of a fresh handshake per job. Only 429/503 are retried
+    (with backoff, honoring Retry-After): those mean the request was not
+    processed. Other 5xx and read timeouts may come after the completion was
+    generated and billed, so the POST is not re-sent; after the last try the
+    response is returned so the normal HTTP error path still reports it.
+    """
+    session = requests.Session()
+    retry = Retry(
+        total=5,
+        read=0,
+        backoff_factor=0.5,
+        status_forcelist=[429, 503],
+        allowed_methods={"POST"},
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=8, pool_maxsize=32, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+_SESSION = _build_session() if requests is not None else None
+
+
+# Request pacing from OpenAI's x-ratelimit-* headers: no wait while there is
+# quota left, and a wait until the reset only once it is (nearly) used up.
+# Shared by the worker threads.
+_BUCKET = {"remaining": math.inf, "reset_at": 0.0}
+_BUCKET_LOCK = threading.Lock()
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_SCALE = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def _parse_reset(value: str) -> float:
+    # "20ms", "1s", "6m0s", "1h2m3.5s" -> seconds
+    return sum(float(n) * _DURATION_SCALE[unit] for n, unit in _DURATION_PART.findall(value or ""))
+
+
+def _update_bucket(headers: Any) -> None:
+    remaining = headers.get("x-ratelimit-remaining-requests")
+    if remaining is None:
+        return
+    try:
+        left = int(remaining)
+    except ValueError:
+        return
+    reset_at = time.monotonic() + _parse_reset(headers.get("x-ratelimit-reset-requests", ""))
+    with _BUCKET_LOCK:
+        _BUCKET["remaining"] = left
+        _BUCKET["reset_at"] = reset_at
+
+
+def _wait_for_bucket() -> None:
+    with _BUCKET_LOCK:
+        if _BUCKET["remaining"] > 1:
+            return
+        # once reset_at has passed the wait is 0; the next response refreshes the numbers
+        delay = _BUCKET["reset_at"] - time.monotonic()
+    if delay > 0:
+        time.sleep(delay)
+
 
 def utc_now_compact() -> str:
     return dt.datetime.utcnow().strftime("%Y%m%d-%H%M%S")
@@ -43,25 +118,56 @@ def write_text(path: str, content: str) -> None:
         f.write(content)
 
 
-def append_text(path: str, content: str) -> None:
+def write_text_atomic(path: str, content: str) -> None:
+    # tmp + os.replace: readers (the publisher) never see a half-written file
     safe_mkdir(os.path.dirname(path))
-    with open(path, "a", encoding="utf-8") as f:
+    tmp = path + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
         f.write(content)
+    os.replace(tmp, path)
+
+
+def append_text(path: str, content: str) -> None:
+    safe_mkdir(os.path.dirname(path))
+    fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        append_fd(fd, content)
+    finally:
+        os.close(fd)
+
+
+def append_fd(fd: int, content: str) -> None:
+    # One os.write() on an O_APPEND descriptor: the kernel places it at the
+    # current end of file, so concurrent writers (other processes included)
+    # can't interleave mid-line.
+    os.write(fd, content.encode("utf-8"))
+
+
+def dumps_pretty(obj: Any) -> str:
+    return dumps_json(obj, indent=True).decode("utf-8")
+
+
+def read_bytes(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
 
 
 def read_json(path: str) -> Dict[str, Any]:
-    with open(path, "r", encoding="utf-8") as f:
-        return json.load(f)
+    return loads_json(read_bytes(path))
 
 
 def write_json(path: str, obj: Dict[str, Any]) -> None:
-    safe_mkdir(os.path.dirname(path))
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
+    write_text_atomic(path, dumps_pretty(obj))
+
+
+def short_hash(s: Union[str, bytes]) -> str:
+    # 10 hex chars, same width as the old sha1 prefix
+    if isinstance(s, str):
+        s = s.encode("utf-8")
+    return hashlib.blake2b(s, digest_size=5).hexdigest()
 
 
-def sha1_short(s: str) -> str:
-    return hashlib.sha1(s.encode("utf-8")).hexdigest()[:10]
+sha1_short = short_hash  # old name, kept for call-site compat
 
 
 def pick_job_type(job: Dict[str, Any]) -> str:
@@ -112,7 +218,9 @@ def openai_chat_completion(prompt: str, model: str, api_key: str, timeout_s: int
     }
 
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=timeout_s)
+        _wait_for_bucket()
+        r = _SESSION.post(url, headers=headers, json=payload, timeout=timeout_s)
+        _update_bucket(r.headers)
         if r.status_code >= 400:
             return (False, f"OpenAI HTTP {r.status_code}: {r.text[:800]}")
         data = r.json()
@@ -122,20 +230,9 @@ def openai_chat_completion(prompt: str, model: str, api_key: str, timeout_s: int
         return (False, f"OpenAI request failed: {repr(e)}")
 
 
-def build_prompt(job: Dict[str, Any], job_path: str) -> str:
-    job_type = pick_job_type(job)
-    title = pick_job_title(job)
-    instr = pick_job_instructions(job)
-    job_raw = json.dumps(job, ensure_ascii=False, indent=2)
-
-    return f"""TASK TYPE: {job_type}
-TITLE: {title}
-
-INSTRUCTIONS:
-{instr}
-
-JOB JSON:
-{job_raw}
+# Static part of the prompt, built once; build_prompt only fills the job slots.
+_PROMPT_HEAD = "TASK TYPE: {job_type}\nTITLE: {title}\n\nINSTRUCTIONS:\n{instr}\n\nJOB JSON:\n"
+_PROMPT_TAIL = """
 
 OUTPUT FORMAT (STRICT):
 1) One-line verdict (max 20 words)
@@ -148,33 +245,42 @@ IMPORTANT:
 - Do NOT pretend you executed external actions unless the job explicitly includes evidence.
 - If info is missing, propose next jobs to fetch/verify it.
 - Keep it practical. No fluff.
-SOURCE FILE: {job_path}
-"""
+SOURCE FILE: """
+
+
+@functools.lru_cache(maxsize=256)
+def _prompt_head(job_type: str, title: str, instr: str) -> str:
+    # batches of same-kind jobs share type/title/instructions: format the head once
+    return _PROMPT_HEAD.format(job_type=job_type, title=title, instr=instr)
+
+
+def build_prompt(job: Dict[str, Any], job_path: str) -> str:
+    head = _prompt_head(pick_job_type(job), pick_job_title(job), pick_job_instructions(job))
+    return "".join((head, dumps_pretty(job), _PROMPT_TAIL, job_path, "\n"))
 
 
 def extract_next_jobs(text: str) -> Optional[list]:
     """
     Best-effort parse of the 'Next jobs' JSON array inside the model output.
-    Looks for the first '[' ... ']' block that parses to a list.
+    Returns the first JSON array that starts at a '[' in the text.
     """
-    # crude but effective: find a bracketed JSON list
+    # raw_decode parses from '[' to the matching ']' in one pass (nested lists and
+    # brackets inside strings included), so there is no find(']') + loads retry loop
+    # prose-only answers: next jobs are objects, so no '[' or no '{' means nothing to find
+    if "[" not in text or "{" not in text:
+        return None
+    decoder = json.JSONDecoder()
     start = text.find("[")
     while start != -1:
-        end = text.find("]", start)
-        if end == -1:
-            break
-        candidate = text[start : end + 1].strip()
         try:
-            parsed = json.loads(candidate)
-            if isinstance(parsed, list):
-                return parsed
-        except Exception:
-            pass
-        start = text.find("[", start + 1)
+            parsed, _end = decoder.raw_decode(text, start)
+            return parsed
+        except ValueError:
+            start = text.find("[", start + 1)
     return None
 
 
-def normalize_next_job(item: Any) -> Optional[Dict[str, Any]]:
+def normalize_next_job(item: Any, created_at: Optional[str] = None) -> Optional[Dict[str, Any]]:
     if not isinstance(item, dict):
         return None
     t = item.get("type") or item.get("job_type") or "general_insight"
@@ -186,16 +292,58 @@ def normalize_next_job(item: Any) -> Optional[Dict[str, Any]]:
         "type": t.strip() or "general_insight",
         "title": title.strip() or "Next job",
         "instructions": instr.strip() or "Do the task.",
-        "created_at": dt.datetime.utcnow().isoformat() + "Z",
+        "created_at": created_at or dt.datetime.utcnow().isoformat() + "Z",
         "origin": "outbox_worker",
     }
 
 
+def _process_one(path: str, model: str, api_key: str) -> Dict[str, Any]:
+    """
+    Read one job and run the model on it. Only reads the job file and does the
+    network call, so it is safe on a worker thread; main() does all writes/moves.
+    Raises if the job file is not valid JSON.
+    """
+    raw = read_bytes(path)
+    job = loads_json(raw)
+
+    job_type = pick_job_type(job)
+    title = pick_job_title(job)
+    instr = pick_job_instructions(job)
+
+    job_id = job.get("id")
+    if not isinstance(job_id, str) or not job_id.strip():
+        # hash the file as read: no re-serialization, independent of key order in memory
+        job_id = short_hash(os.path.basename(path).encode("utf-8") + raw)
+
+    # one clock read for both the result file prefix and meta.ran_at_utc
+    now = dt.datetime.utcnow()
+    prompt = build_prompt(job, path)
+
+    if not api_key:
+        # hard fail: we want real work. Without key we still write a result showing missing config.
+        ok = False
+        answer = "Missing OPENAI_API_KEY. Add the secret and map it into the workflow env.\n\nDONE"
+    else:
+        ok, answer = openai_chat_completion(prompt=prompt, model=model, api_key=api_key, timeout_s=90)
+
+    return {
+        "job_type": job_type,
+        "title": title,
+        "instr": instr,
+        "job_id": job_id,
+        "ts": now.strftime("%Y%m%d-%H%M%S"),
+        "ran_at_utc": now.isoformat() + "Z",
+        "ok": ok,
+        "answer": answer,
+    }
+
+
 def main() -> int:
     in_dir = os.environ.get("IDA_OUTBOX_DIR", "agent_outbox")
     out_dir = os.environ.get("IDA_RESULTS_DIR", "agent_results")
     done_dir = os.environ.get("IDA_DONE_DIR", "agent_outbox_done")
     ops_log = os.environ.get("IDA_OPS_LOG", os.path.join("ops", "logs", "outbox_worker.log"))
+    max_workers = max(1, int(os.environ.get("IDA_MAX_CONCURRENCY", "8")))
 
     model = os.environ.get("OPENAI_MODEL", "gpt-4o-mini")
     api_key = os.environ.get("OPENAI_API_KEY") or os.environ.get("OPENAI_KEY") or ""
@@ -214,85 +362,83 @@ def main() -> int:
     processed = 0
     failed = 0
 
-    for path in job_files:
-        basename = os.path.basename(path)
-        try:
-            job = read_json(path)
-        except Exception as e:
-            failed += 1
-            append_text(ops_log, f"{utc_now_compact()} | bad_json | {basename} | {repr(e)}\n")
-            continue
-
-        job_type = pick_job_type(job)
-        title = pick_job_title(job)
-        instr = pick_job_instructions(job)
-
-        job_id = job.get("id")
-        if not isinstance(job_id, str) or not job_id.strip():
-            job_id = sha1_short(basename + json.dumps(job, ensure_ascii=False))
-
-        ts = utc_now_compact()
-        result_base = f"{ts}_{job_type}_{job_id}".replace("/", "_").replace("\\", "_").replace(" ", "_")
-
-        md_path = os.path.join(out_dir, f"{result_base}.md")
-        meta_path = os.path.join(out_dir, f"{result_base}.meta.json")
-
-        prompt = build_prompt(job, path)
-
-        if not api_key:
-            # hard fail: we want real work. Without key we still write a result showing missing config.
-            ok = False
-            answer = "Missing OPENAI_API_KEY. Add the secret and map it into the workflow env.\n\nDONE"
-        else:
-            ok, answer = openai_chat_completion(prompt=prompt, model=model, api_key=api_key, timeout_s=90)
-
-        meta: Dict[str, Any] = {
-            "job_id": job_id,
-            "job_type": job_type,
-            "title": title,
-            "instructions": instr,
-            "source_job_file": path,
-            "ran_at_utc": dt.datetime.utcnow().isoformat() + "Z",
-            "openai_model": model,
-            "openai_ok": ok,
-        }
-
-        # Next jobs (optional)
-        next_jobs = extract_next_jobs(answer) if isinstance(answer, str) else None
-        if next_jobs:
-            normalized = []
-            for item in next_jobs:
-                nj = normalize_next_job(item)
-                if nj:
-                    normalized.append(nj)
-            if normalized:
-                meta["next_jobs"] = normalized
-
-        # Write outputs
-        header = f"# IDA Result\n\n- **Job:** {title}\n- **Type:** {job_type}\n- **ID:** {job_id}\n- **Time (UTC):** {meta['ran_at_utc']}\n- **Model:** {model}\n- **OpenAI OK:** {ok}\n\n---\n\n"
-        write_text(md_path, header + (answer or ""))
-        write_json(meta_path, meta)
-
-        # Move job to done
-        done_path = os.path.join(done_dir, basename)
-        try:
-            shutil.move(path, done_path)
-        except Exception:
-            # if move fails, copy+remove
+    # Jobs are independent and wait on the network: overlap the API calls on a
+    # thread pool and keep every filesystem mutation here on the main thread.
+    # The ops log stays open (O_APPEND, unbuffered) for the whole batch: one write per job.
+    with open(ops_log, "ab", buffering=0) as logf, \
+            ThreadPoolExecutor(max_workers=max_workers) as ex:
+        futures = {ex.submit(_process_one, path, model, api_key): path for path in job_files}
+        for fut in as_completed(futures):
+            path = futures[fut]
+            basename = os.path.basename(path)
+            stamp = utc_now_compact()
             try:
-                shutil.copy2(path, done_path)
-                os.remove(path)
+                r = fut.result()
             except Exception as e:
-                append_text(ops_log, f"{utc_now_compact()} | move_failed | {basename} | {repr(e)}\n")
-
-        processed += 1
-        append_text(
-            ops_log,
-            f"{utc_now_compact()} | processed | {basename} | job_id={job_id} | type={job_type} | openai_ok={ok}\n",
-        )
-
-        # tiny pause to avoid rate spikes if many jobs
-        time.sleep(0.2)
+                failed += 1
+                append_fd(logf.fileno(), f"{stamp} | bad_json | {basename} | {repr(e)}\n")
+                continue
+
+            job_type = r["job_type"]
+            title = r["title"]
+            job_id = r["job_id"]
+            ok = r["ok"]
+            answer = r["answer"]
+
+            result_base = f"{r['ts']}_{job_type}_{job_id}".replace("/", "_").replace("\\", "_").replace(" ", "_")
+
+            md_path = os.path.join(out_dir, f"{result_base}.md")
+            meta_path = os.path.join(out_dir, f"{result_base}.meta.json")
+
+            meta: Dict[str, Any] = {
+                "job_id": job_id,
+                "job_type": job_type,
+                "title": title,
+                "instructions": r["instr"],
+                "source_job_file": path,
+                "ran_at_utc": r["ran_at_utc"],
+                "openai_model": model,
+                "openai_ok": ok,
+            }
+
+            # Next jobs (optional)
+            next_jobs = extract_next_jobs(answer) if isinstance(answer, str) else None
+            if next_jobs:
+                normalized = []
+                for item in next_jobs:
+                    nj = normalize_next_job(item, created_at=r["ran_at_utc"])
+                    if nj:
+                        normalized.append(nj)
+                if normalized:
+                    meta["next_jobs"] = normalized
+
+            # Write outputs
+            header = f"# IDA Result\n\n- **Job:** {title}\n- **Type:** {job_type}\n- **ID:** {job_id}\n- **Time (UTC):** {meta['ran_at_utc']}\n- **Model:** {model}\n- **OpenAI OK:** {ok}\n\n---\n\n"
+            write_text_atomic(md_path, header + (answer or ""))
+            write_json(meta_path, meta)
+
+            log_lines = []
+
+            # Move job to done
+            done_path = os.path.join(done_dir, basename)
+            try:
+                # same filesystem: one atomic rename
+                os.replace(path, done_path)
+            except OSError as e:
+                try:
+                    if e.errno != errno.EXDEV:
+                        raise
+                    # outbox and done on different devices: copy+remove
+                    shutil.copy2(path, done_path)
+                    os.remove(path)
+                except Exception as e2:
+                    log_lines.append(f"{stamp} | move_failed | {basename} | {repr(e2)}\n")
+
+            processed += 1
+            log_lines.append(
+                f"{stamp} | processed | {basename} | job_id={job_id} | type={job_type} | openai_ok={ok}\n"
+            )
+            append_fd(logf.fileno(), "".join(log_lines))
 
     print(f"Processed: {processed}, Failed: {failed}")
     return 0 if failed == 0 else 2
@@ -6,11 +6,12 @@
 
 from __future__ import annotations
 
-import json
 import os
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any, Dict, Optional
+from typing import Any, Dict, Optional, Tuple
+
+from core.io_utils import dumps_json
 
 
 RESULTS_DIR = os.environ.get("RESULTS_DIR", "agent_results")
@@ -33,6 +34,31 @@ def _safe_float(v: Any) -> Optional[float]:
         return None
 
 
+# Candidate keys / key paths, probed in order.
+_USAGE_PATHS = (("usage",), ("meta", "usage"), ("provider", "usage"), ("openai", "usage"))
+_COST_PATHS = (("cost_usd",), ("meta", "cost_usd"), ("billing", "cost_usd"))
+_STATUS_KEYS = ("status", "state", "result_status")
+_ERROR_KEYS = ("error", "exception", "traceback")
+_JOB_ID_KEYS = ("job_id", "id", "job", "name", "file")
+_REASON_KEYS = ("reason", "message", "error", "exception")
+
+
+def _dig(d: Any, path: Tuple[str, ...]) -> Any:
+    for k in path:
+        if not isinstance(d, dict):
+            return None
+        d = d.get(k)
+    return d
+
+
+def _first_str(d: Dict[str, Any], keys: Tuple[str, ...]) -> Optional[str]:
+    for k in keys:
+        v = d.get(k)
+        if isinstance(v, str) and v.strip():
+            return v.strip()
+    return None
+
+
 def _extract_usage(result: Dict[str, Any]) -> Dict[str, Any]:
     """
     Tries multiple common shapes:
@@ -40,21 +66,9 @@ def _extract_usage(result: Dict[str, Any]) -> Dict[str, Any]:
       - result["meta"]["usage"] ...
       - result["provider"]["usage"] ...
     """
-    for key_path in (
-        ("usage",),
-        ("meta", "usage"),
-        ("provider", "usage"),
-        ("openai", "usage"),
-    ):
-        cur: Any = result
-        ok = True
-        for k in key_path:
-            if isinstance(cur, dict) and k in cur:
-                cur = cur[k]
-            else:
-                ok = False
-                break
-        if ok and isinstance(cur, dict):
+    for path in _USAGE_PATHS:
+        cur = _dig(result, path)
+        if isinstance(cur, dict):
             return cur
     return {}
 
@@ -66,44 +80,29 @@ def _extract_cost(result: Dict[str, Any]) -> Optional[float]:
       - result["meta"]["cost_usd"]
       - result["billing"]["cost_usd"]
     """
-    candidates = [
-        result.get("cost_usd"),
-        (result.get("meta") or {}).get("cost_usd") if isinstance(result.get("meta"), dict) else None,
-        (result.get("billing") or {}).get("cost_usd") if isinstance(result.get("billing"), dict) else None,
-    ]
-    for c in candidates:
-        f = _safe_float(c)
+    for path in _COST_PATHS:
+        f = _safe_float(_dig(result, path))
         if f is not None:
             return f
     return None
 
 
 def _extract_status(result: Dict[str, Any]) -> str:
-    for k in ("status", "state", "result_status"):
-        v = result.get(k)
-        if isinstance(v, str) and v.strip():
-            return v.strip().lower()
+    status = _first_str(result, _STATUS_KEYS)
+    if status:
+        return status.lower()
     # fallback: if error present -> fail else ok
-    if result.get("error") or result.get("exception") or result.get("traceback"):
-        return "fail"
-    return "ok"
+    return "fail" if any(result.get(k) for k in _ERROR_KEYS) else "ok"
 
 
 def _extract_job_id(result: Dict[str, Any]) -> str:
-    for k in ("job_id", "id", "job", "name", "file"):
-        v = result.get(k)
-        if isinstance(v, str) and v.strip():
-            return v.strip()
-    return f"job-{_utc_now().strftime('%Y%m%d-%H%M%S')}"
+    return _first_str(result, _JOB_ID_KEYS) or f"job-{_utc_now().strftime('%Y%m%d-%H%M%S')}"
 
 
 def _extract_reason(result: Dict[str, Any]) -> Optional[str]:
     # Keep it short and safe
-    for k in ("reason", "message", "error", "exception"):
-        v = result.get(k)
-        if isinstance(v, str) and v.strip():
-            return v.strip().replace("\n", " ")[:160]
-    return None
+    reason = _first_str(result, _REASON_KEYS)
+    return reason.replace("\n", " ")[:160] if reason else None
 
 
 def _format_daily_line(ts: datetime, job_id: str, status: str, tokens: Optional[int], cost: Optional[float], reason: Optional[str]) -> str:
@@ -142,8 +141,7 @@ def write_result_output(result: Dict[str, Any], filename_hint: Optional[str] = N
 
     # Write JSON atomically-ish
     tmp_path = results_dir / (out_name + ".tmp")
-    with tmp_path.open("w", encoding="utf-8") as f:
-        json.dump(result, f, ensure_ascii=False, indent=2)
+    tmp_path.write_bytes(dumps_json(result, indent=True))
     tmp_path.replace(result_path)
 
     # 2) Daily markdown append-only log
@@ -166,9 +164,13 @@ def write_result_output(result: Dict[str, Any], filename_hint: Optional[str] = N
     line = _format_daily_line(ts, job_id, status, tokens, cost, reason)
 
     # IMPORTANT: logging must never break production flow
+    # One os.write on an O_APPEND fd: concurrent writers can't split a line.
     try:
-        with daily_file.open("a", encoding="utf-8") as f:
-            f.write(line)
+        fd = os.open(daily_file, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf-8"))
+        finally:
+            os.close(fd)
     except Exception:
         # swallow logging errors (production rule)
         pass
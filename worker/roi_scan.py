@@ -1,11 +1,16 @@
 # worker/roi_scan.py
 from __future__ import annotations
 
+import functools
 import json
 import os
+from collections import ChainMap
 from dataclasses import dataclass
 from datetime import datetime, timezone
-from typing import Any, Dict, Optional
+from pathlib import Path
+from typing import Any, Dict, Final, Optional
+
+from core.io_utils import dumps_json, write_bytes
 
 
 def _utc_now_iso() -> str:
@@ -26,21 +31,12 @@ def _write_text(path: str, text: str) -> None:
     parent = os.path.dirname(path)
     if parent:
         _ensure_dir(parent)
-    with open(path, "w", encoding="utf-8") as f:
-        f.write(text)
-
-
-def _append_text(path: str, text: str) -> None:
-    parent = os.path.dirname(path)
-    if parent:
-        _ensure_dir(parent)
-    with open(path, "a", encoding="utf-8") as f:
-        f.write(text)
+    write_bytes(path, text.encode("utf-8"))
 
 
 def _safe_json(obj: Any) -> str:
     try:
-        return json.dumps(obj, indent=2, ensure_ascii=False, sort_keys=True)
+        return dumps_json(obj, indent=True, sort_keys=True).decode("utf-8")
     except Exception:
         return json.dumps({"error": "failed_to_json_dump"}, indent=2)
 
@@ -51,113 +47,76 @@ class RoiConfig:
     ops_log_path: str
 
 
-def _build_roi_plan_md(job: Dict[str, Any]) -> str:
-    created = job.get("created_at") or job.get("time") or _utc_now_iso()
-    job_id = job.get("job_id") or job.get("id") or "unknown"
-
-    inp = job.get("input") or {}
-    goal = inp.get("goal") or "Lag ROI-plan som kan gi inntekt raskt"
-    timeframe = inp.get("timeframe") or "48 timer (plan) / 30 dager (første inntekt)"
-    market = inp.get("market") or "Global"
-    budget = inp.get("budget") or "0"
-    legal_scope = inp.get("legal_scope") or "EU"
-    risk = inp.get("risk_tolerance") or "Lav"
-    target = inp.get("target_customer") or "Små SaaS/solopreneurs"
-
-    # Her er det helt bevisst MARKDOWN-tekst inne i en Python-string.
-    # Den skal skrives til ROI_PLAN.md (ikke være "kode").
-    return f"""# ROI Plan — API resale
-
-Job ID: {job_id}  
-Generated: {created}
-
-## Input
-- Goal: {goal}
-- Timeframe: {timeframe}
-- Market: {market}
-- Budget: {budget}
-- Legal scope: {legal_scope}
-- Risk tolerance: {risk}
-- Target customer: {target}
-- Deliverable: ROI plan
-
----
-
-## 1) Tilbud (det vi selger)
-
-**Produkt:** "AI-funksjon inn i ditt SaaS"
-
-**Kjerne:** Du tilbyr en "white-label AI-backend" som kunden kan kalle via API (chat/support/analyse),
-slik at de slipper å bygge LLM-stack selv.
-
-**Pakker (enkelt og brutalt):**
-- Starter: €49/mnd — 5k requests/mnd, basis-modell, standard rate limit
-- Pro: €149/mnd — 25k requests/mnd, logging + enklere "guardrails"
-- Agency: €399/mnd — 100k requests/mnd, 3 kunder/prosjekter, prioritet + SLA-light
-
-**Upsell (lav friksjon):**
-- Setup-fee: €199–€499 for integrasjon (engangs)
-- Custom prompt + tone: €99/mnd
-- Compliance/PII mode: €99/mnd (EU-friendly)
-
----
-
-## 2) MVP i repoet (hva du faktisk trenger)
+# ROI_PLAN.md-malen ligger i ROI_PLAN.md.tmpl ved siden av denne fila og leses
+# først ved første ROI-plan (ikke ved import). Det er helt bevisst MARKDOWN-tekst;
+# plassholdere fylles med str.format_map, og {{{{navn}}}} blir {{navn}} i fila.
+_ROI_MD_TEMPLATE_PATH: Final[Path] = Path(__file__).with_name("ROI_PLAN.md.tmpl")
 
-**Minimum:**
-- 1 endpoint: `/chat` eller `/support_reply`
-- API key auth
-- Logging: request_count + basic cost estimate
-- Simple dashboard/CSV export (senere)
 
-**Teknisk stack forslag (lav friksjon):**
-- FastAPI + uvicorn
-- 1 provider (OpenAI først)
-- SQLite eller JSON-logg (start billig)
+@functools.cache
+def _roi_md_template() -> str:
+    return _ROI_MD_TEMPLATE_PATH.read_text(encoding="utf-8")
 
----
 
-## 3) Første 3 kundekanaler (0-budsjett)
+# Standardverdier for tomme/manglende input-felt (ChainMap faller tilbake hit).
+_ROI_DEFAULTS: Final[Dict[str, str]] = {
+    "job_id": "unknown",
+    "goal": "Lag ROI-plan som kan gi inntekt raskt",
+    "timeframe": "48 timer (plan) / 30 dager (første inntekt)",
+    "market": "Global",
+    "budget": "0",
+    "legal_scope": "EU",
+    "risk": "Lav",
+    "target": "Små SaaS/solopreneurs",
+}
 
-1. LinkedIn: SaaS-founders + indiehackers (målrettet DM)
-2. Cold e-post: finn 30 små SaaS (1–10 ansatte) → enkel pitch
-3. Discord/communities: indie/saas communities → post "done-for-you AI API"
-
----
-
-## 4) Outreach-melding (kort)
-
-**Subject:** "Jeg kan gi deg AI-support i produktet ditt på 24t"
-
-Hei {{{{navn}}}},
-
-Jeg lager en liten "white-label AI API" som du kan plugge inn i ditt SaaS for chat/support,
-uten å bygge LLM-stack selv.
-
-Hvis du vil, kan jeg sette opp en demo i ditt miljø på 24–48t.
-
-Vil du at jeg sender en 2-min demo + pris?
-
----
-
-## 5) 72t plan (praktisk)
-
-- Dag 1: Velg 1 usecase (support reply) + endpoint + API key
-- Dag 2: Lag demo landing + 20–30 outreach (LinkedIn/e-post)
-- Dag 3: Book 2 calls, tilby "setup-fee" + månedspakke
-
----
-
-## 6) Suksesskriterie
-
-- 30 kontakter → 3 svar → 1 betalt pilot
-- Mål: €49–€149 første måned → bevis → skaler outreach
-"""
 
+def _build_roi_plan_md(job: Dict[str, Any]) -> str:
+    inp = job.get("input") or {}
+    values = {
+        "created": job.get("created_at") or job.get("time") or _utc_now_iso(),
+        "job_id": job.get("job_id") or job.get("id"),
+        "goal": inp.get("goal"),
+        "timeframe": inp.get("timeframe"),
+        "market": inp.get("market"),
+        "budget": inp.get("budget"),
+        "legal_scope": inp.get("legal_scope"),
+        "risk": inp.get("risk_tolerance"),
+        "target": inp.get("target_customer"),
+    }
+    # kun truthy verdier, samme semantikk som `x or default`
+    return _roi_md_template().format_map(ChainMap({k: v for k, v in values.items() if v}, _ROI_DEFAULTS))
+
+
+class _Log:
+    """
+    Ops-logg for én run(): åpnes ved første linje, holdes åpen (bufret) og
+    skrives ut av close().
+    """
 
-def _log_line(cfg: RoiConfig, level: str, msg: str, job_id: str) -> None:
-    ts = _utc_now_iso()
-    _append_text(cfg.ops_log_path, f"{ts} [{level}] ROI_SCAN job_id={job_id} {msg}\n")
+    def __init__(self, path: str, job_id: str, ts: str) -> None:
+        self.path = path
+        self.job_id = job_id
+        self.ts = ts
+        self.f = None
+
+    def line(self, level: str, msg: str) -> None:
+        if self.f is None:
+            parent = os.path.dirname(self.path)
+            if parent:
+                _ensure_dir(parent)
+            self.f = open(self.path, "a", encoding="utf-8", buffering=8192)
+        self.f.write(f"{self.ts} [{level}] ROI_SCAN job_id={self.job_id} {msg}\n")
+
+    def close(self) -> None:
+        if self.f is None:
+            return
+        try:
+            self.f.close()
+        except Exception:
+            # logging skal aldri ødelegge jobbresultatet
+            pass
+        self.f = None
 
 
 def run(job: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
@@ -173,20 +132,23 @@ def run(job: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         ops_log_path=_env("IDA_OPS_LOG", os.path.join("ops", "logs", "AUTORUN_LOG.md")),
     )
 
+    # ett tidsstempel for hele runnen: logglinjer, resultat og feilrapport
+    now = _utc_now_iso()
+    log = _Log(cfg.ops_log_path, job_id, now)
     try:
-        _log_line(cfg, "INFO", "start", job_id)
+        log.line("INFO", "start")
 
         roi_plan_md = _build_roi_plan_md(job)
         roi_plan_path = os.path.join(cfg.results_dir, "ROI_PLAN.md")
         _write_text(roi_plan_path, roi_plan_md)
 
-        _log_line(cfg, "INFO", f"wrote {roi_plan_path}", job_id)
+        log.line("INFO", f"wrote {roi_plan_path}")
 
         return {
             "ok": True,
             "task": "ROI_SCAN",
             "job_id": job_id,
-            "time": _utc_now_iso(),
+            "time": now,
             "deliverables": {
                 "agent_results/ROI_PLAN.md": roi_plan_path,
                 "ops/logs/AUTORUN_LOG.md": cfg.ops_log_path,
@@ -197,7 +159,7 @@ def run(job: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         failed_path = os.path.join(cfg.results_dir, "ROI_FAILED.md")
         text = (
             "# TASK FAILED\n\n"
-            f"- time: {_utc_now_iso()}\n"
+            f"- time: {now}\n"
             "- task: ROI_SCAN\n"
             f"- job: {job_id}\n\n"
             "## Message\n"
@@ -209,7 +171,7 @@ def run(job: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         )
         _write_text(failed_path, text)
         try:
-            _log_line(cfg, "ERROR", f"failed: {type(e).__name__}: {e}", job_id)
+            log.line("ERROR", f"failed: {type(e).__name__}: {e}")
         except Exception:
             pass
 
@@ -217,7 +179,9 @@ def run(job: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
             "ok": False,
             "task": "ROI_SCAN",
             "job_id": job_id,
-            "time": _utc_now_iso(),
+            "time": now,
             "error": f"{type(e).__name__}: {e}",
             "failed_path": failed_path,
         }
+    finally:
+        log.close()
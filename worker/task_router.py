@@ -8,15 +8,22 @@
 from __future__ import annotations
 
 import os
+import errno
+import shutil
+import heapq
+import functools
+import importlib
 import sys
-import json
 import time
 import traceback
 import logging
+import logging.handlers
 from dataclasses import dataclass
-from datetime import datetime, timezone
+from functools import cached_property
 from pathlib import Path
-from typing import Any, Dict, Optional, Tuple
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from core.io_utils import dumps_json, loads_json, write_bytes
 
 
 # -------------------------
@@ -36,6 +43,10 @@ OPS_LOG = Path(_env("IDA_OPS_LOG", "ops/logs/outbox_worker.log"))
 MAX_JOBS_PER_RUN = int(_env("IDA_MAX_JOBS_PER_RUN", "20"))  # safety
 SLEEP_BETWEEN_JOBS_SEC = float(_env("IDA_SLEEP_BETWEEN_JOBS_SEC", "0.1"))
 
+# JSON-filer routeren skriver (done/) er for maskiner: kompakt som standard,
+# IDA_JSON_PRETTY=1 gir indent=2 for feilsøking.
+JSON_PRETTY = _env("IDA_JSON_PRETTY", "0").lower() in ("1", "true", "yes")
+
 # Optional: hvis du vil at routeren skal skrive en "heartbeat" hver run:
 WRITE_RUN_HEARTBEAT = _env("IDA_WRITE_RUN_HEARTBEAT", "true").lower() in ("1", "true", "yes")
 
@@ -45,23 +56,48 @@ WRITE_RUN_HEARTBEAT = _env("IDA_WRITE_RUN_HEARTBEAT", "true").lower() in ("1", "
 # -------------------------
 
 def _setup_logging() -> None:
+    # Idempotent: bare første kall konfigurerer, så gjentatte main()-kall (in-process)
+    # ikke stabler nye FileHandlers på samme logg.
+    if logging.getLogger().handlers:
+        return
     OPS_LOG.parent.mkdir(parents=True, exist_ok=True)
+    fmt = "%(asctime)s | %(levelname)s | %(message)s"
+    file_handler = logging.FileHandler(OPS_LOG, encoding="utf-8", delay=True)
+    file_handler.setFormatter(logging.Formatter(fmt))
+    # Ops-loggen bufres i minnet og skrives samlet: ved ERROR, når bufferen er full,
+    # ved _flush_logs() på slutten av en tick og ved exit (logging.shutdown).
+    buffered = logging.handlers.MemoryHandler(capacity=1000, flushLevel=logging.ERROR, target=file_handler)
     logging.basicConfig(
         level=logging.INFO,
-        format="%(asctime)s | %(levelname)s | %(message)s",
+        format=fmt,
         handlers=[
-            logging.FileHandler(OPS_LOG, encoding="utf-8"),
+            buffered,
             logging.StreamHandler(sys.stdout),
         ],
     )
 
 
-def _utc_now_str() -> str:
-    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S UTC")
+def _flush_logs() -> None:
+    for h in logging.getLogger().handlers:
+        h.flush()
+
 
+@dataclass(frozen=True)
+class Tick:
+    """Tidsstempler for én router-tick, regnet ut én gang og delt av alle jobbene."""
+    now_str: str  # "YYYY-mm-dd HH:MM:SS UTC" (tekst i resultater/metadata)
+    stamp: str  # "YYYYmmddTHHMMSSZ" (filnavn)
 
-def _ts_compact() -> str:
-    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+def _new_tick() -> Tick:
+    # time.gmtime + %-formatering: fast ASCII-format i UTC, ingen datetime/tz/strftime
+    t = time.gmtime()
+    ymd = (t.tm_year, t.tm_mon, t.tm_mday)
+    hms = (t.tm_hour, t.tm_min, t.tm_sec)
+    return Tick(
+        now_str="%04d-%02d-%02d %02d:%02d:%02d UTC" % (ymd + hms),
+        stamp="%04d%02d%02dT%02d%02d%02dZ" % (ymd + hms),
+    )
 
 
 # -------------------------
@@ -81,35 +117,46 @@ class Job:
         # remove dots to avoid weird names
         return base.replace(".", "_")
 
+    @cached_property
+    def data_pretty(self) -> str:
+        # pen job-JSON til Markdown-rapportene, serialisert én gang per jobb
+        return dumps_json(self.data, indent=True).decode("utf-8")
+
 
 # -------------------------
 # IO helpers
 # -------------------------
 
 def _read_json(p: Path) -> Dict[str, Any]:
-    with p.open("r", encoding="utf-8") as f:
-        return json.load(f)
+    return loads_json(p.read_bytes())
+
+
+@functools.lru_cache(maxsize=256)
+def _ensure_dir(d: Path) -> None:
+    # Samme håndfull mapper (results/done) brukes av alle jobbene i en tick:
+    # mkdir én gang per mappe, ikke før hver skriving.
+    d.mkdir(parents=True, exist_ok=True)
 
 
 def _write_text(p: Path, text: str) -> None:
-    p.parent.mkdir(parents=True, exist_ok=True)
-    with p.open("w", encoding="utf-8") as f:
-        f.write(text)
+    _ensure_dir(p.parent)
+    write_bytes(p, text.encode("utf-8"))
 
 
 def _write_json(p: Path, obj: Any) -> None:
-    p.parent.mkdir(parents=True, exist_ok=True)
-    with p.open("w", encoding="utf-8") as f:
-        json.dump(obj, f, ensure_ascii=False, indent=2)
+    _ensure_dir(p.parent)
+    write_bytes(p, dumps_json(obj, indent=JSON_PRETTY))
 
 
 def _safe_move(src: Path, dst: Path) -> None:
-    dst.parent.mkdir(parents=True, exist_ok=True)
+    _ensure_dir(dst.parent)
     try:
-        src.replace(dst)  # atomic-ish
-    except Exception:
-        # fallback copy+delete
-        dst.write_bytes(src.read_bytes())
+        os.replace(src, dst)  # atomisk rename, ett syscall
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        # outbox og done på forskjellige filsystemer: copy+delete
+        shutil.copyfile(src, dst)
         src.unlink(missing_ok=True)
 
 
@@ -118,15 +165,18 @@ def _safe_move(src: Path, dst: Path) -> None:
 # -------------------------
 
 def _list_jobs_fifo(outbox: Path) -> list[Path]:
-    if not outbox.exists():
+    # Tom outbox er vanligste tilfelle: ett scandir, ingen exists()-stat, ingen heap.
+    try:
+        with os.scandir(outbox) as it:
+            entries = [e for e in it if e.is_file() and e.name.lower().endswith(".json")]
+    except FileNotFoundError:
+        return []
+    if not entries:
         return []
-    files = []
-    for p in outbox.iterdir():
-        if p.is_file() and p.suffix.lower() == ".json":
-            files.append(p)
-    # FIFO = eldste først: mtime
-    files.sort(key=lambda x: x.stat().st_mtime)
-    return files
+    # FIFO = eldste først: mtime. main() tar maks MAX_JOBS_PER_RUN, så vi trenger bare
+    # de k eldste (+1 så main fortsatt ser at grensen ble nådd) – O(N log k), ikke full sort.
+    oldest = heapq.nsmallest(MAX_JOBS_PER_RUN + 1, entries, key=lambda e: e.stat().st_mtime_ns)
+    return [Path(e.path) for e in oldest]
 
 
 def _load_job(p: Path) -> Job:
@@ -141,6 +191,28 @@ def _load_job(p: Path) -> Job:
 # Executors
 # -------------------------
 
+# Mapping: legg til flere når du vil – men UNKNOWN skal aldri stoppe verden.
+# task -> (modul, funksjonsnavn i prioritert rekkefølge). Modulen importeres først
+# når tasken faktisk dukker opp, så det ikke kræsjer om en modul mangler.
+_EXECUTORS: Dict[str, Tuple[str, Tuple[str, ...]]] = {
+    "ROI_SCAN": ("worker.roi_scan", ("run_roi_scan", "main", "run")),
+    # Eksempel på andre task-typer (hvis de finnes i mappa tasks/):
+    # "WEB_SEARCH": ("worker.tasks.web_search", ("run",)),
+}
+
+
+@functools.cache
+def _resolve_executor(task_upper: str) -> Callable[..., Any]:
+    # import + getattr-probing én gang per task; feil caches ikke, så neste jobb prøver igjen
+    module_name, names = _EXECUTORS[task_upper]
+    module = importlib.import_module(module_name)
+    for name in names:
+        fn = getattr(module, name, None)
+        if fn is not None:
+            return fn
+    raise RuntimeError(f"{module_name.rsplit('.', 1)[-1]}: no {'/'.join(names)} found")
+
+
 def _try_run_known_executor(job: Job) -> Tuple[bool, str]:
     """
     Returns: (handled, message)
@@ -148,64 +220,48 @@ def _try_run_known_executor(job: Job) -> Tuple[bool, str]:
       - handled=False means no executor mapping exists for this task.
     """
     task_upper = job.task.strip().upper()
+    if task_upper not in _EXECUTORS:
+        return False, f"No executor mapping for task={job.task}"
 
-    # Mapping: legg til flere når du vil – men UNKNOWN skal aldri stoppe verden.
-    # Vi gjør imports inne i funksjonen så det ikke kræsjer om en modul mangler.
-    if task_upper == "ROI_SCAN":
-        try:
-            from worker.roi_scan import run_roi_scan  # type: ignore
-        except Exception:
-            # fallback hvis funksjonen heter noe annet i din kode
-            try:
-                import worker.roi_scan as roi_scan  # type: ignore
-                run_roi_scan = getattr(roi_scan, "main", None) or getattr(roi_scan, "run", None)
-                if run_roi_scan is None:
-                    raise RuntimeError("roi_scan: no run_roi_scan/main/run found")
-            except Exception as e:
-                return True, f"ROI_SCAN executor import failed: {e}"
-
-        # Kjør ROI scan
+    try:
+        run_executor = _resolve_executor(task_upper)
+    except Exception as e:
+        return True, f"{task_upper} executor import failed: {e}"
+
+    try:
+        run_executor(job.data, RESULTS_DIR)  # forventet signatur: (job_data, results_dir)
+        return True, f"{task_upper} executed."
+    except TypeError:
+        # hvis executoren ikke tar args; prøv uten
         try:
-            run_roi_scan(job.data, RESULTS_DIR)  # forventet signatur: (job_data, results_dir)
-            return True, "ROI_SCAN executed."
-        except TypeError:
-            # hvis din roi_scan ikke tar args; prøv uten
-            try:
-                run_roi_scan()  # type: ignore
-                return True, "ROI_SCAN executed (no-arg)."
-            except Exception as e:
-                return True, f"ROI_SCAN execution failed: {e}"
+            run_executor()  # type: ignore
+            return True, f"{task_upper} executed (no-arg)."
         except Exception as e:
-            return True, f"ROI_SCAN execution failed: {e}"
-
-    # Eksempel på andre task-typer (hvis de finnes i mappa tasks/)
-    # Du kan legge disse til senere uten å røre fallbacken:
-    # if task_upper == "WEB_SEARCH": ...
-    # if task_upper == "DAILY_JOB": ...
-
-    return False, f"No executor mapping for task={job.task}"
+            return True, f"{task_upper} execution failed: {e}"
+    except Exception as e:
+        return True, f"{task_upper} execution failed: {e}"
 
 
-def _fallback_unknown(job: Job, reason: str) -> str:
+def _fallback_unknown(job: Job, reason: str, tick: Tick) -> str:
     """
     Always produce a visible result file for UNKNOWN tasks.
     Returns result filename.
     """
-    ts = _ts_compact()
+    ts = tick.stamp
     result_name = f"UNKNOWN_TASK_{job.id_hint}_{ts}.md"
     result_path = RESULTS_DIR / result_name
 
     body = []
     body.append(f"# UNKNOWN TASK HANDLED (fallback)\n")
-    body.append(f"- time: {_utc_now_str()}")
+    body.append(f"- time: {tick.now_str}")
     body.append(f"- job_file: `{job.path.as_posix()}`")
     body.append(f"- task: `{job.task}`")
     body.append(f"- reason: `{reason}`\n")
     body.append("## Raw job JSON\n")
-    body.append("```json\n" + json.dumps(job.data, ensure_ascii=False, indent=2) + "\n```\n")
+    body.append("```json\n" + job.data_pretty + "\n```\n")
 
     _write_text(result_path, "".join(body))
-    logging.warning(f"Fallback wrote result: {result_path.as_posix()}")
+    logging.warning("Fallback wrote result: %s", result_path.as_posix())
     return result_name
 
 
@@ -213,51 +269,69 @@ def _fallback_unknown(job: Job, reason: str) -> str:
 # Processing
 # -------------------------
 
-def _mark_done(job: Job, status: str, note: str = "") -> Path:
+def _mark_done(job: Job, status: str, tick: Tick, note: str = "") -> Path:
     """
     Move job JSON into DONE_DIR with status in filename.
     """
-    ts = _ts_compact()
+    ts = tick.stamp
     safe_status = status.replace(" ", "_")
     dst_name = f"{job.id_hint}.{safe_status}.{ts}.json"
     dst = DONE_DIR / dst_name
 
-    # optionally enrich job with metadata before moving
+    # Berik jobben med metadata og skriv den rett inn i done/ (kompakt med mindre
+    # IDA_JSON_PRETTY – done-filer er historikk for maskiner), i stedet for å skrive
+    # originalen på nytt og så flytte. tmp + os.replace så done/ aldri har en halvskrevet fil.
     try:
         job.data["_router"] = {
-            "time_utc": _utc_now_str(),
+            "time_utc": tick.now_str,
             "task": job.task,
             "status": status,
             "note": note[:3000],
         }
-        # write temp then move original? simplest: overwrite original with enriched
-        _write_json(job.path, job.data)
+        _ensure_dir(dst.parent)
+        tmp = dst.with_name(dst.name + ".tmp")
+        _write_json(tmp, job.data)
+        os.replace(tmp, dst)
     except Exception:
-        pass
+        # fikk ikke skrevet den berikede kopien: flytt originalen som den er
+        _safe_move(job.path, dst)
+        return dst
 
-    _safe_move(job.path, dst)
+    job.path.unlink(missing_ok=True)
     return dst
 
 
-def _write_run_heartbeat() -> None:
+def _quarantine_bad_json(p: Path, tick: Tick) -> Path:
+    """
+    Flytt en jobbfil som ikke kan parses ut av outbox, så senere ticks ikke leser den
+    på nytt. Hver tick er en ny prosess, så en negativ cache i minnet ville ikke hjulpet.
+    """
+    dst = DONE_DIR / f"{p.stem}.FAILED_bad_json.{tick.stamp}.json"
+    _safe_move(p, dst)
+    logging.error("Moved unparseable job to %s", dst.name)
+    return dst
+
+
+def _write_run_heartbeat(tick: Tick) -> None:
     # Light, harmless proof the runner is alive
     hb = RESULTS_DIR / "RUNNER_HEARTBEAT.md"
-    txt = f"# Runner heartbeat\n\nLast run: {_utc_now_str()}\n"
+    txt = f"# Runner heartbeat\n\nLast run: {tick.now_str}\n"
     _write_text(hb, txt)
 
 
-def process_one(job_path: Path) -> None:
+def process_one(job_path: Path, tick: Optional[Tick] = None) -> None:
+    tick = tick or _new_tick()
     job = _load_job(job_path)
-    logging.info(f"Picked job: {job.path.name} task={job.task}")
+    logging.info("Picked job: %s task=%s", job.path.name, job.task)
 
     # Try executor
     handled, msg = _try_run_known_executor(job)
 
     if not handled:
         # Unknown task => ALWAYS produce output + mark done
-        result_file = _fallback_unknown(job, msg)
-        done_path = _mark_done(job, "FAILED_unknown_task", f"{msg} | result={result_file}")
-        logging.warning(f"UNKNOWN -> FAILED_unknown_task moved to {done_path.name}")
+        result_file = _fallback_unknown(job, msg, tick)
+        done_path = _mark_done(job, "FAILED_unknown_task", tick, f"{msg} | result={result_file}")
+        logging.warning("UNKNOWN -> FAILED_unknown_task moved to %s", done_path.name)
         return
 
     # If handled=True, we might still have "execution failed" in msg.
@@ -265,79 +339,89 @@ def process_one(job_path: Path) -> None:
     lower = msg.lower()
     if "failed" in lower or "error" in lower or "exception" in lower or "import failed" in lower:
         # Still produce an explicit result file, so you see WHY it failed.
-        ts = _ts_compact()
+        ts = tick.stamp
         result_name = f"TASK_FAILED_{job.task}_{job.id_hint}_{ts}.md".replace(" ", "_")
         result_path = RESULTS_DIR / result_name
         _write_text(
             result_path,
-            f"# TASK FAILED\n\n- time: {_utc_now_str()}\n- task: `{job.task}`\n- job: `{job.path.name}`\n\n## Message\n{msg}\n\n## Raw job JSON\n```json\n{json.dumps(job.data, ensure_ascii=False, indent=2)}\n```\n",
+            f"# TASK FAILED\n\n- time: {tick.now_str}\n- task: `{job.task}`\n- job: `{job.path.name}`\n\n## Message\n{msg}\n\n## Raw job JSON\n```json\n{job.data_pretty}\n```\n",
         )
-        done_path = _mark_done(job, "FAILED_executor_error", f"{msg} | result={result_name}")
-        logging.error(f"{job.task} -> FAILED_executor_error moved to {done_path.name}")
+        done_path = _mark_done(job, "FAILED_executor_error", tick, f"{msg} | result={result_name}")
+        logging.error("%s -> FAILED_executor_error moved to %s", job.task, done_path.name)
         return
 
-    done_path = _mark_done(job, "DONE", msg)
-    logging.info(f"{job.task} -> DONE moved to {done_path.name}")
+    done_path = _mark_done(job, "DONE", tick, msg)
+    logging.info("%s -> DONE moved to %s", job.task, done_path.name)
 
 
 def main() -> int:
     _setup_logging()
 
     # Ensure dirs exist
-    OUTBOX_DIR.mkdir(parents=True, exist_ok=True)
-    DONE_DIR.mkdir(parents=True, exist_ok=True)
-    RESULTS_DIR.mkdir(parents=True, exist_ok=True)
-    OPS_LOG.parent.mkdir(parents=True, exist_ok=True)
+    for d in (OUTBOX_DIR, DONE_DIR, RESULTS_DIR, OPS_LOG.parent):
+        _ensure_dir(d)
 
     logging.info("=== task_router tick start ===")
-    logging.info(f"OUTBOX={OUTBOX_DIR.as_posix()} DONE={DONE_DIR.as_posix()} RESULTS={RESULTS_DIR.as_posix()}")
+    logging.info("OUTBOX=%s DONE=%s RESULTS=%s", OUTBOX_DIR.as_posix(), DONE_DIR.as_posix(), RESULTS_DIR.as_posix())
+
+    # Én tick = ett sett tidsstempler for heartbeat, resultater og done-filnavn
+    tick = _new_tick()
 
     if WRITE_RUN_HEARTBEAT:
         try:
-            _write_run_heartbeat()
+            _write_run_heartbeat(tick)
         except Exception as e:
-            logging.warning(f"Could not write heartbeat: {e}")
+            logging.warning("Could not write heartbeat: %s", e)
 
     jobs = _list_jobs_fifo(OUTBOX_DIR)
     if not jobs:
         logging.info("No jobs in outbox.")
         logging.info("=== task_router tick end ===")
+        _flush_logs()
         return 0
 
     count = 0
     for p in jobs:
         # Safety cap
         if count >= MAX_JOBS_PER_RUN:
-            logging.warning(f"Max jobs per run reached ({MAX_JOBS_PER_RUN}). Stop.")
+            logging.warning("Max jobs per run reached (%d). Stop.", MAX_JOBS_PER_RUN)
             break
 
         try:
-            process_one(p)
+            process_one(p, tick)
         except Exception as e:
             # HARD fallback: never crash the workflow
-            logging.error(f"Process job crashed: {p.name} err={e}")
-            logging.error(traceback.format_exc())
+            # logging.exception formatterer traceback lat via exc_info (cachet på recorden
+            # for alle handlers); crash-rapporten under bruker sin egen tb-streng
+            logging.exception("Process job crashed: %s err=%s", p.name, e)
+            tb = traceback.format_exc()
 
             # Try to salvage: move job to done + write crash report
             try:
-                job = _load_job(p)
-                ts = _ts_compact()
-                crash_name = f"ROUTER_CRASH_{job.id_hint}_{ts}.md"
-                crash_path = RESULTS_DIR / crash_name
-                _write_text(
-                    crash_path,
-                    f"# ROUTER CRASH\n\n- time: {_utc_now_str()}\n- job: `{p.name}`\n- task: `{job.task}`\n\n## Exception\n```\n{traceback.format_exc()}\n```\n",
-                )
-                done_path = _mark_done(job, "FAILED_router_crash", f"router crashed | result={crash_name}")
-                logging.error(f"Moved crashed job to {done_path.name}")
+                try:
+                    job = _load_job(p)
+                except ValueError:
+                    # json/orjson.JSONDecodeError er ValueError: ingen jobb å rapportere på
+                    _quarantine_bad_json(p, tick)
+                else:
+                    ts = tick.stamp
+                    crash_name = f"ROUTER_CRASH_{job.id_hint}_{ts}.md"
+                    crash_path = RESULTS_DIR / crash_name
+                    _write_text(
+                        crash_path,
+                        f"# ROUTER CRASH\n\n- time: {tick.now_str}\n- job: `{p.name}`\n- task: `{job.task}`\n\n## Exception\n```\n{tb}\n```\n",
+                    )
+                    done_path = _mark_done(job, "FAILED_router_crash", tick, f"router crashed | result={crash_name}")
+                    logging.error("Moved crashed job to %s", done_path.name)
             except Exception as e2:
-                logging.error(f"Could not salvage crashed job {p.name}: {e2}")
+                logging.error("Could not salvage crashed job %s: %s", p.name, e2)
 
         count += 1
         time.sleep(SLEEP_BETWEEN_JOBS_SEC)
 
-    logging.info(f"Processed jobs this tick: {count}")
+    logging.info("Processed jobs this tick: %d", count)
     logging.info("=== task_router tick end ===")
+    _flush_logs()
     return 0
 
 
@@ -346,8 +430,6 @@ if __name__ == "__main__":
     try:
         sys.exit(main())
     except Exception:
-        # mega-hard fallback
-        _setup_logging()
-        logging.error("FATAL: task_router main crashed, but forcing exit 0.")
-        logging.error(traceback.format_exc())
+        # mega-hard fallback (logging er allerede satt opp av main)
+        logging.exception("FATAL: task_router main crashed, but forcing exit 0.")
         sys.exit(0)
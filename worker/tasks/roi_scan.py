@@ -2,13 +2,21 @@
 from __future__ import annotations
 
 import os
-import json
+import functools
+import time
 from dataclasses import dataclass
-from datetime import datetime, timezone
 from typing import Any, Dict, Tuple, Optional
 
 import requests
 
+from core.io_utils import dumps_json, loads_json
+
+
+# One Session per process: ROI_SCAN calls reuse the keep-alive TCP/TLS connection
+# to api.openai.com instead of a new handshake per job.
+_SESSION = requests.Session()
+_SESSION.headers.update({"Content-Type": "application/json"})
+
 
 @dataclass
 class RoiScanResult:
@@ -18,12 +26,86 @@ class RoiScanResult:
     error: Optional[str] = None
 
 
+# The prompt scaffolding is the same for every job; only the four fields vary.
+_PROMPT_TEMPLATE = """
+Du er IDA. Svar på norsk. Lag en ROI-plan som er HANDLINGSRETTET og kortfattet.
+Mål: {goal}
+Tidslinje: {timeframe}
+
+Kontekst:
+{context}
+
+Rammer/constraints:
+{constraints}
+
+Krav:
+- Maks 1 side (Markdown).
+- Start med: "## ROI PLAN (IDA)"
+- Inkluder:
+  1) "Hva vi bygger (1 setning)"
+  2) "Første inntekts-vei (konkret)"
+  3) "48-timers plan" (punktliste, timebox)
+  4) "Metrikker" (hva måles daglig)
+  5) "Risiko & kill-criteria" (når vi stopper/endre kurs)
+  6) "Neste automatisering IDA gjør alene" (konkret)
+- Ikke prat om teori, ikke skriv lange forklaringer.
+""".strip()
+
+
+@functools.lru_cache(maxsize=1)
+def _stamp_at(second: int) -> str:
+    return time.strftime("%Y%m%dT%H%M%SZ", time.gmtime(second))
+
+
 def _utc_stamp() -> str:
-    return datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    # second resolution: calls within the same second reuse the formatted string
+    return _stamp_at(int(time.time()))
 
 
 def _safe_json(obj: Any) -> str:
-    return json.dumps(obj, ensure_ascii=False, indent=2)
+    return dumps_json(obj, indent=True).decode("utf-8")
+
+
+def _loads_response(r: requests.Response) -> Any:
+    # parse the raw bytes directly (skips the str decode in r.json())
+    return loads_json(r.content)
+
+
+def _extract_text_slow(data: Any) -> str:
+    # Try to extract text from common response shapes
+    text = ""
+    if isinstance(data, dict):
+        # responses api: output -> content -> text
+        out = data.get("output")
+        if isinstance(out, list) and out:
+            # Find first output_text-like content
+            for item in out:
+                content = item.get("content") if isinstance(item, dict) else None
+                if isinstance(content, list):
+                    for c in content:
+                        if isinstance(c, dict) and c.get("type") in ("output_text", "text"):
+                            text = c.get("text", "") or ""
+                            break
+                    if text:
+                        break
+
+        # Fallback
+        if not text:
+            text = data.get("text", "") or ""
+    return text
+
+
+def _extract_text(data: Any) -> str:
+    # Fast path: the documented Responses API shape output[0].content[0].text.
+    # Anything else (reasoning item first, refusal, other shapes) takes the full walk.
+    try:
+        c = data["output"][0]["content"][0]
+        text = c["text"]
+        if c.get("type") not in ("output_text", "text") or not isinstance(text, str) or not text:
+            raise TypeError
+        return text
+    except (KeyError, IndexError, TypeError, AttributeError):
+        return _extract_text_slow(data)
 
 
 def _call_openai_markdown(prompt: str) -> Tuple[bool, str, str]:
@@ -39,10 +121,7 @@ def _call_openai_markdown(prompt: str) -> Tuple[bool, str, str]:
 
     # Responses API (modern). If your account blocks it, we fail cleanly and report needs.
     url = "https://api.openai.com/v1/responses"
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json",
-    }
+    headers = {"Authorization": f"Bearer {api_key}"}
 
     payload = {
         "model": model,
@@ -52,32 +131,15 @@ def _call_openai_markdown(prompt: str) -> Tuple[bool, str, str]:
     }
 
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=60)
-        if r.status_code >= 400:
-            return False, "", f"OpenAI HTTP {r.status_code}: {r.text[:500]}"
-        data = r.json()
-
-        # Try to extract text from common response shapes
-        text = ""
-        if isinstance(data, dict):
-            # responses api: output -> content -> text
-            out = data.get("output")
-            if isinstance(out, list) and out:
-                # Find first output_text-like content
-                for item in out:
-                    content = item.get("content") if isinstance(item, dict) else None
-                    if isinstance(content, list):
-                        for c in content:
-                            if isinstance(c, dict) and c.get("type") in ("output_text", "text"):
-                                text = c.get("text", "") or ""
-                                break
-                        if text:
-                            break
-
-            # Fallback
-            if not text:
-                text = data.get("text", "") or ""
-
+        # stream=True: the body is only read when needed, so an error response is capped
+        # at 512 bytes. (connect, read) timeout fails fast on a dead handshake.
+        with _SESSION.post(url, headers=headers, json=payload, stream=True, timeout=(5, 60)) as r:
+            if r.status_code >= 400:
+                head = next(r.iter_content(512), b"").decode("utf-8", "replace")
+                return False, "", f"OpenAI HTTP {r.status_code}: {head[:500]}"
+            data = _loads_response(r)
+
+        text = _extract_text(data)
         text = (text or "").strip()
         if not text:
             return False, "", "OpenAI returned empty text"
@@ -116,29 +178,9 @@ def run_roi_scan(job: Dict[str, Any]) -> RoiScanResult:
         )
 
     # Build a single sharp prompt (no essay-mode)
-    prompt = f"""
-Du er IDA. Svar på norsk. Lag en ROI-plan som er HANDLINGSRETTET og kortfattet.
-Mål: {goal}
-Tidslinje: {timeframe}
-
-Kontekst:
-{context}
-
-Rammer/constraints:
-{constraints}
-
-Krav:
-- Maks 1 side (Markdown).
-- Start med: "## ROI PLAN (IDA)"
-- Inkluder:
-  1) "Hva vi bygger (1 setning)"
-  2) "Første inntekts-vei (konkret)"
-  3) "48-timers plan" (punktliste, timebox)
-  4) "Metrikker" (hva måles daglig)
-  5) "Risiko & kill-criteria" (når vi stopper/endre kurs)
-  6) "Neste automatisering IDA gjør alene" (konkret)
-- Ikke prat om teori, ikke skriv lange forklaringer.
-""".strip()
+    prompt = _PROMPT_TEMPLATE.format_map(
+        {"goal": goal, "timeframe": timeframe, "context": context, "constraints": constraints}
+    )
 
     ok, md, err = _call_openai_markdown(prompt)
 